@@ -0,0 +1,106 @@
+import os
+import random
+from results_io import split_extension, write_results
+
+# Risultati minimi prima di valutare la convergenza (con pochi elementi anche il bootstrap è instabile)
+MIN_RECORDS = 30
+
+
+def adaptive_batches(items, batch_size, seed=None):
+    """Mescola le coppie (indice, record) con il seed indicato e le restituisce a blocchi di `batch_size`."""
+    items = list(items)
+    random.Random(seed).shuffle(items)
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def correlation_intervals(results, n_bootstrap=1000, confidence=0.95, seed=None):
+    """
+    Correlazioni (Overall) dei risultati valutati finora con i relativi intervalli di confidenza bootstrap.
+
+    Returns:
+        dict: {metodo: (correlazione, limite inferiore, limite superiore)}; None con meno di due coppie.
+    """
+    from correlations import METHODS, correlation_table, results_frame
+
+    table = correlation_table(results_frame(results), n_bootstrap=n_bootstrap, confidence=confidence, seed=seed)
+    if table.empty or table.iloc[0]["n"] < 2:
+        return None
+    row = table.iloc[0]
+    return {method: (row[method], row.get(f"{method}_low"), row.get(f"{method}_high")) for method in METHODS}
+
+
+def ci_width(intervals):
+    """Ampiezza massima degli intervalli di confidenza delle tre correlazioni (inf se non calcolabile)."""
+    widths = [high - low for _, low, high in intervals.values()]
+    if not widths or any(width != width for width in widths):
+        return float("inf")
+    return max(widths)
+
+
+def run_adaptive(evaluate, items, output_file, target_width, batch_size=50, max_records=None, max_cost=None,
+                 metrics=None, n_bootstrap=1000, confidence=0.95, seed=None, keep_prompts=False):
+    """
+    Valutazione sequenziale: valuta i record a blocchi casuali (riproducibili con `seed`) e dopo ogni blocco
+    ricalcola Pearson, Spearman e Kendall-Tau con gli intervalli di confidenza bootstrap. Si ferma quando
+    l'ampiezza massima degli intervalli scende sotto `target_width` (dopo almeno `MIN_RECORDS` risultati),
+    quando si raggiunge `max_records` o il costo stimato `max_cost`, o quando il dataset è esaurito.
+
+    Args:
+        evaluate (callable): `evaluate(batch, output_path)` valuta un blocco di coppie (indice, record)
+            salvandolo in `output_path` e restituisce i risultati (es. `main.run_evaluation`).
+        items (iterable): Coppie (indice, record) del dataset (vedi `loaders.load_dataset`).
+        output_file (str): File in cui salvare, dopo ogni blocco, tutti i risultati valutati finora.
+        target_width (float): Ampiezza obiettivo degli intervalli di confidenza.
+        batch_size (int): Record valutati per blocco.
+        max_records (int): Numero massimo di record da valutare (nessun limite se None); in tc_usr e pc_usr ogni
+            record produce un risultato per risposta.
+        max_cost (float): Costo massimo stimato in USD (richiede `metrics`); il blocco successivo non viene
+            avviato se, al costo medio per record osservato, supererebbe il budget.
+        metrics (RunMetrics): Metriche del client, usate per il costo speso.
+
+    Returns:
+        dict: results, intervals (ultime correlazioni con intervalli), history (una voce per blocco) e reason.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size deve essere almeno 1.")
+    root, extension = split_extension(output_file)
+    batch_output = f"{root}.adaptive-batch{extension or '.json'}"
+
+    results, history, intervals = [], [], None
+    records = 0
+    reason = "dataset esaurito"
+    for batch in adaptive_batches(items, batch_size, seed):
+        if max_records is not None:
+            if records >= max_records:
+                reason = "numero massimo di record"
+                break
+            batch = batch[:max_records - records]
+        if max_cost is not None and metrics is not None and records:
+            spent = metrics.summary()["cost_usd"]
+            if spent + spent / records * len(batch) > max_cost:
+                reason = "budget di costo"
+                break
+
+        results.extend(evaluate(batch, batch_output))
+        records += len(batch)
+        os.remove(batch_output)
+        write_results(results, output_file, keep_prompts)
+
+        intervals = correlation_intervals(results, n_bootstrap, confidence, seed)
+        width = ci_width(intervals) if intervals else float("inf")
+        history.append({"records": records, "results": len(results), "width": width, "intervals": intervals})
+        if intervals:
+            summary = ", ".join(f"{method} {value:.4f} [{low:.4f}, {high:.4f}]"
+                                for method, (value, low, high) in intervals.items())
+            print(f"\nAdattivo: {records} record valutati ({len(results)} risultati), {summary}; ampiezza massima {width:.4f} "
+                  f"(obiettivo {target_width})")
+        if len(results) >= MIN_RECORDS and width <= target_width:
+            reason = "intervalli di confidenza convergenti"
+            break
+    else:
+        if max_records is not None and records >= max_records:
+            reason = "numero massimo di record"
+
+    print(f"Valutazione adattiva terminata ({reason}) dopo {records} record ({len(results)} risultati). Risultati salvati in {output_file}")
+    return {"results": results, "intervals": intervals, "history": history, "reason": reason}
@@ -0,0 +1,128 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import traceback
+from prettytable import PrettyTable
+from benchmarks.stub_server import StubConfig, start_stub_server
+from g_eval import GEvalAPI
+from loaders import load_dataset
+from main import run_evaluation
+
+# Dataset e template usati per ogni modalità: (input_file, single_template_path, full_template_path)
+BENCHMARK_MODES = {
+    "fed": ("datasets/fed_data.json", "prompts/fed_single_response.txt", "prompts/fed_full_dialogue.txt"),
+    "tc_usr": ("datasets/tc_usr_data.json", "prompts/tc_usr_single_response.txt", None),
+    "pc_usr": ("datasets/pc_usr_data.json", "prompts/pc_usr_single_response.txt", None),
+    "dstc": ("datasets/dstc9_data.json", None, "prompts/dstc_full_dialogue.txt"),
+    "convai": ("datasets/convai2_data.json", None, "prompts/convai_full_dialogue.txt"),
+}
+
+
+def benchmark_mode(mode, base_url, num_records, max_concurrency, seed, run_options):
+    """Esegue una modalità contro lo stub (in un processo dedicato) e ne misura throughput, latenza e memoria."""
+    input_file, single_template_path, full_template_path = BENCHMARK_MODES[mode]
+    g_eval = GEvalAPI(api_key="stub", model="stub", max_concurrency=max_concurrency, base_url=base_url)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        data = load_dataset(mode, input_file, num_records, seed)
+        results = run_evaluation(mode, data, g_eval, single_template_path, full_template_path,
+                                 os.path.join(output_dir, f"{mode}.json"), **run_options)
+        elapsed = time.perf_counter() - start
+
+    summary = g_eval.metrics.summary()
+    return {
+        "mode": mode,
+        "items": len(results),
+        "requests": summary["api_requests"],
+        "seconds": elapsed,
+        "items_per_second": len(results) / elapsed if elapsed else float("nan"),
+        "p50_ms": 1000 * (summary["latency_p50"] or float("nan")),
+        "p99_ms": 1000 * (summary["latency_p99"] or float("nan")),
+        "parse_failures": summary["parse_failures"],
+        "unparsed": summary["unparsed"],
+        # ru_maxrss è in KB su Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _benchmark_mode(mode, *args):
+    """
+    Esegue `benchmark_mode` nel processo worker. Le eccezioni dell'API OpenAI non possono essere ricostruite nel
+    processo principale (il pool resterebbe bloccato): vengono convertite in RuntimeError con il traceback.
+    """
+    try:
+        return benchmark_mode(mode, *args)
+    except Exception:
+        raise RuntimeError(f"modalità {mode}: {traceback.format_exc()}") from None
+
+
+def run_benchmarks(modes, num_records, max_concurrency, stub_config, seed=0, run_options=None):
+    """
+    Avvia lo stub locale ed esegue ogni modalità in un processo separato, così il picco di RSS
+    misurato è quello della singola modalità.
+    """
+    server, base_url = start_stub_server(stub_config)
+    try:
+        context = multiprocessing.get_context("spawn")
+        reports = []
+        for mode in modes:
+            with context.Pool(1) as pool:
+                try:
+                    reports.append(pool.apply(_benchmark_mode, (mode, base_url, num_records, max_concurrency, seed,
+                                                                run_options or {})))
+                except RuntimeError as e:
+                    print(f"Benchmark fallito: {e}")
+                    reports.append({"mode": mode, "error": str(e)})
+        return reports
+    finally:
+        server.shutdown()
+
+
+def print_report(reports):
+    table = PrettyTable(["Modalità", "Item", "Richieste", "Tempo (s)", "Item/s", "p50 (ms)", "p99 (ms)",
+                         "Parsing falliti", "Senza punteggio", "RSS picco (MB)"])
+    for report in reports:
+        if "error" in report:
+            table.add_row([report["mode"], "fallita"] + ["-"] * 8)
+            continue
+        table.add_row([report["mode"], report["items"], report["requests"], f"{report['seconds']:.2f}",
+                       f"{report['items_per_second']:.1f}", f"{report['p50_ms']:.1f}", f"{report['p99_ms']:.1f}",
+                       report["parse_failures"], report["unparsed"], f"{report['peak_rss_mb']:.1f}"])
+    print(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end degli evaluator contro un server stub locale.")
+    parser.add_argument("--modes", type=str, nargs="+", default=list(BENCHMARK_MODES), choices=list(BENCHMARK_MODES),
+                        help="Modalità da misurare.")
+    parser.add_argument("--num_records", type=int, default=50, help="Record campionati per modalità.")
+    parser.add_argument("--max_concurrency", type=int, default=8, help="Richieste contemporanee.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Latenza media dello stub (secondi).")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Deviazione standard della latenza (secondi).")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Frazione di errori 500 iniettati.")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="Frazione di errori 429 iniettati.")
+    parser.add_argument("--scoring", type=str, default="single", choices=["single", "logprobs", "samples"],
+                        help="Calcolo del punteggio da misurare.")
+    parser.add_argument("--output_format", type=str, default="text", choices=["text", "json"],
+                        help="Formato delle risposte da misurare.")
+    parser.add_argument("--malformed_rate", type=float, default=0.0,
+                        help="Frazione di risposte dello stub senza punteggi (misura le nuove richieste del formato).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed per campionamento e stub.")
+    parser.add_argument("--output", type=str, default=None, help="File JSON in cui salvare i risultati (opzionale).")
+    args = parser.parse_args()
+
+    stub_config = StubConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                             rate_limit_rate=args.rate_limit_rate, seed=args.seed, malformed_rate=args.malformed_rate)
+    reports = run_benchmarks(args.modes, args.num_records, args.max_concurrency, stub_config, args.seed,
+                             {"scoring": args.scoring, "output_format": args.output_format})
+    print_report(reports)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=4)
+        print(f"Risultati del benchmark salvati in {args.output}")
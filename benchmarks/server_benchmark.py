@@ -0,0 +1,135 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlparse
+from prettytable import PrettyTable
+from benchmarks.stub_server import StubConfig, start_stub_server
+from g_eval import GEvalAPI
+from loaders import load_dataset
+from metrics import percentile
+from server import ScoringService, start_server
+
+
+def load_turns(num_records, seed=0, input_file="datasets/tc_usr_data.json"):
+    """Coppie (turni del contesto, risposta) dai record tc_usr: più risposte condividono lo stesso contesto."""
+    turns = []
+    for _, instance in load_dataset("tc_usr", input_file, num_records, seed):
+        context = [line.replace("User: ", "").replace("System: ", "").strip() for line in instance["context"].split("\n")]
+        for entry in instance["responses"]:
+            turns.append((context, entry["response"].replace("System: ", "").strip()))
+    return turns
+
+
+def run_clients(url, turns, num_clients):
+    """
+    Invia le valutazioni con `num_clients` client concorrenti (una connessione keep-alive ciascuno).
+
+    Returns:
+        tuple(list[float], int, int): Latenze lato client delle valutazioni riuscite, risposte 503 ed errori.
+    """
+    address = urlparse(url)
+    latencies, counts, lock = [], {"rejected": 0, "errors": 0}, threading.Lock()
+    items = iter(turns)
+
+    def client():
+        connection = http.client.HTTPConnection(address.hostname, address.port, timeout=300)
+        while True:
+            with lock:
+                item = next(items, None)
+            if item is None:
+                break
+            body = json.dumps({"context": item[0], "response": item[1]})
+            start = time.perf_counter()
+            connection.request("POST", "/score", body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            with lock:
+                if response.status == 200:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    counts["rejected" if response.status == 503 else "errors"] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(num_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, counts["rejected"], counts["errors"]
+
+
+def benchmark_server(base_url, turns, num_clients, max_batch_size, max_wait_ms, max_pending, max_concurrency,
+                     batch_template_path=None):
+    """Avvia il servizio contro lo stub e ne misura throughput e latenza lato client."""
+    g_eval = GEvalAPI(api_key="stub", model="stub", max_concurrency=max_concurrency, base_url=base_url)
+    service = ScoringService(g_eval, "prompts/tc_usr_single_response.txt", batch_template_path=batch_template_path,
+                             max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, max_pending=max_pending)
+    server, url = start_server(service, port=0)
+    try:
+        start = time.perf_counter()
+        latencies, rejected, errors = run_clients(url, turns, num_clients)
+        elapsed = time.perf_counter() - start
+        summary = service.summary()
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+    return {
+        "max_batch_size": max_batch_size,
+        "batching": "contesto" if batch_template_path else "no",
+        "items": len(latencies),
+        "api_requests": summary["client"]["api_requests"],
+        "seconds": elapsed,
+        "items_per_second": len(latencies) / elapsed if elapsed else float("nan"),
+        "p50_ms": 1000 * (percentile(latencies, 50) or float("nan")),
+        "p99_ms": 1000 * (percentile(latencies, 99) or float("nan")),
+        "mean_batch_size": summary["mean_batch_size"],
+        "rejected": rejected,
+        "errors": errors,
+    }
+
+
+def print_report(reports):
+    table = PrettyTable(["Micro-batch", "Batch per contesto", "Item", "Richieste API", "Tempo (s)", "Item/s",
+                         "p50 (ms)", "p99 (ms)", "Batch medio", "503", "Errori"])
+    for report in reports:
+        table.add_row([report["max_batch_size"], report["batching"], report["items"], report["api_requests"],
+                       f"{report['seconds']:.2f}", f"{report['items_per_second']:.1f}", f"{report['p50_ms']:.1f}",
+                       f"{report['p99_ms']:.1f}", f"{report['mean_batch_size']:.1f}", report["rejected"],
+                       report["errors"]])
+    print(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del servizio di valutazione (server.py) contro lo stub locale.")
+    parser.add_argument("--num_records", type=int, default=20, help="Record tc_usr da cui prendere le risposte.")
+    parser.add_argument("--num_clients", type=int, default=32, help="Client HTTP concorrenti.")
+    parser.add_argument("--max_batch_sizes", type=int, nargs="+", default=[1, 16],
+                        help="Dimensioni massime dei micro-batch da confrontare.")
+    parser.add_argument("--max_wait_ms", type=float, default=5, help="Attesa massima per completare un micro-batch.")
+    parser.add_argument("--max_pending", type=int, default=256, help="Valutazioni in attesa oltre le quali si risponde 503.")
+    parser.add_argument("--max_concurrency", type=int, default=8, help="Richieste contemporanee verso lo stub.")
+    parser.add_argument("--batch_template_path", type=str, default=None,
+                        help="Template batch: le risposte con lo stesso contesto vengono valutate insieme.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Latenza media dello stub (secondi).")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Deviazione standard della latenza (secondi).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed per campionamento e stub.")
+    parser.add_argument("--output", type=str, default=None, help="File JSON in cui salvare i risultati (opzionale).")
+    args = parser.parse_args()
+
+    stub, stub_url = start_stub_server(StubConfig(latency=args.latency, jitter=args.jitter, seed=args.seed))
+    try:
+        turns = load_turns(args.num_records, args.seed)
+        reports = [benchmark_server(stub_url, turns, args.num_clients, max_batch_size, args.max_wait_ms,
+                                    args.max_pending, args.max_concurrency, args.batch_template_path)
+                   for max_batch_size in args.max_batch_sizes]
+    finally:
+        stub.shutdown()
+    print_report(reports)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=4)
+        print(f"Risultati del benchmark salvati in {args.output}")
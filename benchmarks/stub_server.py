@@ -0,0 +1,192 @@
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FORMAT_LINE = re.compile(r"^(.*?):\s*<score>\s*$")
+BATCH_LINE = re.compile(r"^Response\s*\d+\s*-\s*(.*?):\s*<score>\s*$")
+BATCH_SLOT = re.compile(r"^Response (\d+):", re.MULTILINE)
+
+
+class StubConfig:
+    """Parametri del server stub: latenza, errori iniettati e intervallo dei punteggi restituiti."""
+
+    def __init__(self, latency=0.2, jitter=0.05, error_rate=0.0, rate_limit_rate=0.0, retry_after=1,
+                 min_score=1, max_score=3, seed=None, malformed_rate=0.0, logprobs=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.min_score = min_score
+        self.max_score = max_score
+        self.malformed_rate = malformed_rate
+        self.logprobs = logprobs
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def draw(self):
+        with self.lock:
+            self.requests += 1
+            return self.random.random(), max(0.0, self.random.gauss(self.latency, self.jitter))
+
+    def score(self):
+        with self.lock:
+            return self.random.randint(self.min_score, self.max_score)
+
+    def malformed(self):
+        with self.lock:
+            return self.random.random() < self.malformed_rate
+
+
+def canned_content(messages, config, json_mode=False):
+    """
+    Costruisce una risposta nel formato richiesto dal prompt: per ogni riga "<Nome>: <score>" dopo
+    "Response Format:" restituisce "<Nome>: N"; per il formato batch una riga per risposta numerata.
+    Con `json_mode` restituisce un oggetto JSON {"<Nome>": N}; con probabilità `malformed_rate` una
+    risposta senza punteggi.
+    """
+    if config.malformed():
+        return "The response is coherent and engaging."
+    text = "\n".join(message["content"] for message in messages)
+    format_lines = text.split("Response Format:", 1)[1].strip().splitlines() if "Response Format:" in text else []
+
+    lines = []
+    for line in format_lines:
+        line = line.strip()
+        batch = BATCH_LINE.match(line)
+        if batch:
+            for slot in BATCH_SLOT.findall(text):
+                lines.append((f"Response {slot} - {batch.group(1)}", config.score()))
+            break
+        match = FORMAT_LINE.match(line)
+        if match:
+            lines.append((match.group(1), config.score()))
+    lines = lines or [("Overall Quality", config.score())]
+    if json_mode:
+        return json.dumps(dict(lines))
+    return "\n".join(f"{name}: {score}" for name, score in lines)
+
+
+def canned_logprobs(content, config):
+    """Logprob fittizi: per ogni token-punteggio distribuisce la probabilità tra tutti i punteggi ammessi."""
+    tokens = []
+    for piece in re.findall(r"\d+|[^\d]+", content):
+        if piece.isdigit():
+            scores = range(config.min_score, config.max_score + 1)
+            weights = [0.6 if str(score) == piece else 0.4 / max(1, len(scores) - 1) for score in scores]
+            alternatives = [{"token": str(score), "logprob": math.log(weight), "bytes": None}
+                            for score, weight in zip(scores, weights)]
+        else:
+            alternatives = [{"token": piece, "logprob": 0.0, "bytes": None}]
+        tokens.append({"token": piece, "logprob": alternatives[0]["logprob"], "bytes": None,
+                       "top_logprobs": alternatives})
+    return {"content": tokens}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Coda di accept ampia: il client apre molte connessioni contemporanee
+    request_queue_size = 256
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config = StubConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Percorso non supportato: {self.path}"}})
+            return
+
+        roll, latency = self.config.draw()
+        time.sleep(latency)
+
+        if roll < self.config.rate_limit_rate:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                            {"Retry-After": str(self.config.retry_after)})
+            return
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self._send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+
+        messages = body.get("messages", [])
+        choices = []
+        for index in range(body.get("n", 1)):
+            json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+            content = canned_content(messages, self.config, json_mode)
+            choice = {"index": index, "finish_reason": "stop",
+                      "message": {"role": "assistant", "content": content}}
+            if body.get("logprobs") and self.config.logprobs:
+                choice["logprobs"] = canned_logprobs(content, self.config)
+            choices.append(choice)
+
+        prompt_tokens = sum(len(message["content"].split()) for message in messages)
+        completion_tokens = sum(len(choice["message"]["content"].split()) for choice in choices)
+        self._send_json(200, {
+            "id": f"stub-{self.config.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": choices,
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": 0}},
+        })
+
+
+def start_stub_server(config=None, host="127.0.0.1", port=0):
+    """
+    Avvia il server stub in un thread in background.
+
+    Returns:
+        tuple: (server, base_url) — chiamare `server.shutdown()` per fermarlo.
+    """
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config or StubConfig()})
+    server = StubServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server stub locale compatibile con le chat completions OpenAI.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Indirizzo di ascolto.")
+    parser.add_argument("--port", type=int, default=8000, help="Porta di ascolto.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Latenza media per richiesta (secondi).")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Deviazione standard della latenza (secondi).")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Frazione di richieste con errore 500.")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="Frazione di richieste con errore 429.")
+    parser.add_argument("--retry_after", type=int, default=1, help="Valore dell'header Retry-After sui 429.")
+    parser.add_argument("--min_score", type=int, default=1, help="Punteggio minimo restituito.")
+    parser.add_argument("--max_score", type=int, default=3, help="Punteggio massimo restituito.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed per latenze, errori e punteggi.")
+    parser.add_argument("--malformed_rate", type=float, default=0.0,
+                        help="Frazione di risposte senza punteggi (per provare le nuove richieste del formato).")
+    parser.add_argument("--no_logprobs", action="store_true",
+                        help="Ignora la richiesta di logprob, come gli endpoint che non li supportano.")
+    args = parser.parse_args()
+
+    stub_config = StubConfig(args.latency, args.jitter, args.error_rate, args.rate_limit_rate, args.retry_after,
+                             args.min_score, args.max_score, args.seed, args.malformed_rate,
+                             not args.no_logprobs)
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": stub_config})
+    print(f"Server stub in ascolto su http://{args.host}:{args.port}/v1")
+    StubServer((args.host, args.port), handler).serve_forever()
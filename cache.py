@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    Cache persistente su SQLite delle risposte del modello.
+
+    Le voci sono indicizzate da un hash SHA-256 dei parametri della richiesta (modello, messaggi,
+    n, max_tokens, temperature, top_p, ...), quindi due richieste identiche condividono la stessa
+    risposta. Le voci più vecchie di `max_age_days` vengono eliminate, e se la dimensione totale
+    supera `max_size_mb` si eliminano quelle usate meno di recente.
+
+    Con `read_only=True` (es. dry run) il database esistente viene solo letto: nessun file creato,
+    nessuna voce scritta o eliminata.
+    """
+
+    def __init__(self, path="results/cache.sqlite", max_size_mb=512, max_age_days=30, refresh=False,
+                 read_only=False):
+        self.path = path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self.refresh = refresh
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        if read_only:
+            self.conn = sqlite3.connect(f"{pathlib.Path(path).resolve().as_uri()}?mode=ro", uri=True,
+                                        check_same_thread=False, timeout=30)
+            return
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Più processi (es. shard lanciati in parallelo) possono condividere lo stesso database
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON responses (accessed_at)")
+        self.conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(request_kwargs):
+        payload = json.dumps(request_kwargs, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Restituisce il valore associato a `key`, oppure None (sempre None in modalità refresh)."""
+        with self._lock:
+            if self.refresh:
+                self.misses += 1
+                return None
+            row = self.conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age_seconds and time.time() - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            if not self.read_only:
+                self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def contains(self, key):
+        """True se `key` è in cache e non è scaduta (senza aggiornare statistiche né data di accesso)."""
+        with self._lock:
+            if self.refresh:
+                return False
+            row = self.conn.execute("SELECT created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            return row is not None and not (self.max_age_seconds and time.time() - row[0] > self.max_age_seconds)
+
+    def put(self, key, value):
+        if self.read_only:
+            return
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), now, now),
+            )
+            self.conn.commit()
+            self._puts += 1
+        if self._puts % 500 == 0:
+            self.evict()
+
+    def evict(self):
+        """Elimina le voci scadute e, se necessario, quelle usate meno di recente fino a rientrare nel limite."""
+        if self.read_only:
+            return
+        with self._lock:
+            if self.max_age_seconds:
+                self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+            if self.max_size_bytes:
+                total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_size_bytes:
+                    excess = total - self.max_size_bytes
+                    freed = 0
+                    stale_keys = []
+                    for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+                        if freed >= excess:
+                            break
+                        stale_keys.append((key,))
+                        freed += size
+                    self.conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+            self.conn.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+import openai
+from retry import AdaptiveLimiter, CircuitBreaker, TokenBucket
+
+# Errori legati al singolo endpoint (chiave non valida o senza permessi, modello non disponibile):
+# con altri endpoint attivi l'endpoint viene escluso invece di interrompere l'esecuzione
+ENDPOINT_ERRORS = (openai.AuthenticationError, openai.PermissionDeniedError, openai.NotFoundError)
+
+
+class Endpoint:
+    """
+    Un endpoint del pool (URL base + API key) con peso nel routing, concorrenza massima, limite di
+    richieste al minuto e, opzionalmente, un nome di modello proprio (es. deployment con nomi diversi).
+    """
+
+    def __init__(self, base_url, api_key, name=None, weight=1.0, max_concurrency=8, requests_per_minute=None,
+                 model=None):
+        if weight <= 0:
+            raise ValueError(f"Il peso dell'endpoint deve essere positivo (ricevuto {weight}).")
+        self.base_url = base_url
+        self.api_key = api_key
+        # Nel nome compaiono solo le ultime cifre della chiave
+        self.name = name or f"{base_url} (...{(api_key or '')[-4:]})"
+        self.weight = weight
+        self.model = model
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.breaker = CircuitBreaker()
+        self.bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        # Richieste assegnate all'endpoint in attesa del rate limit o di uno slot di concorrenza
+        self.queued = 0
+        self.assigned = 0
+        self.disabled = False
+        self.client = None
+        self.async_client = None
+
+    def ready_at(self):
+        """Istante da cui l'endpoint accetta richieste (dopo la pausa del circuit breaker)."""
+        return self.breaker.open_until
+
+    def load(self):
+        """Carico rispetto al peso: richieste in corso o in coda e, a parità, richieste assegnate in totale."""
+        return (self.limiter.in_flight + self.queued) / self.weight, self.assigned / self.weight
+
+
+class ClientPool:
+    """
+    Endpoint usati da `GEvalAPI`. Ogni richiesta viene assegnata all'endpoint disponibile meno carico
+    rispetto al suo peso; dopo un errore la stessa richiesta evita l'endpoint per il tempo di attesa
+    del retry e passa subito a un altro endpoint, se disponibile.
+
+    Le connessioni HTTP sono condivise: c'è un client per URL base, da cui derivano (`with_options`) quelli
+    delle singole API key. I client asincroni restano aperti tra una chiamata e l'altra di `run`.
+    """
+
+    def __init__(self, endpoints):
+        if not endpoints:
+            raise ValueError("Il pool richiede almeno un endpoint.")
+        self.endpoints = list(endpoints)
+        names = [endpoint.name for endpoint in self.endpoints]
+        if len(set(names)) != len(names):
+            for i, endpoint in enumerate(self.endpoints):
+                endpoint.name = f"{endpoint.name} #{i}"
+        self._clients = {}
+        self._async_clients = {}
+        self._loop = None
+
+    @property
+    def max_concurrency(self):
+        return sum(endpoint.limiter.max_limit for endpoint in self.endpoints)
+
+    def pick(self, avoid=None):
+        """
+        Sceglie l'endpoint meno carico tra quelli attivi e disponibili, escludendo quelli che la richiesta
+        deve evitare (`avoid`: {endpoint: istante fino a cui evitarlo}).
+
+        Returns:
+            tuple: (endpoint, 0) oppure, se nessuno è disponibile, (None, secondi di attesa).
+        """
+        active = [endpoint for endpoint in self.endpoints if not endpoint.disabled]
+        if not active:
+            raise RuntimeError("Nessun endpoint attivo: tutti esclusi dopo errori non ritentabili.")
+        avoid = avoid or {}
+        now = time.monotonic()
+        available_at = {endpoint: max(endpoint.ready_at(), avoid.get(endpoint, 0.0)) for endpoint in active}
+        ready = [endpoint for endpoint, at in available_at.items() if at <= now]
+        if not ready:
+            return None, min(available_at.values()) - now
+        endpoint = min(ready, key=Endpoint.load)
+        endpoint.assigned += 1
+        return endpoint, 0.0
+
+    def acquire_sync(self, avoid=None):
+        while True:
+            endpoint, delay = self.pick(avoid)
+            if endpoint is not None:
+                return endpoint
+            time.sleep(delay)
+
+    async def acquire(self, avoid=None):
+        while True:
+            endpoint, delay = self.pick(avoid)
+            if endpoint is not None:
+                return endpoint
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot(self, endpoint, bucket=None):
+        """
+        Attende il rate limit globale (`bucket`) e quello dell'endpoint, poi uno slot di concorrenza.
+        Restituisce False se nel frattempo l'endpoint è stato escluso o sospeso: la richiesta va riassegnata.
+        """
+        endpoint.queued += 1
+        queued = True
+        try:
+            if bucket:
+                await bucket.acquire()
+            if endpoint.bucket:
+                await endpoint.bucket.acquire()
+            async with endpoint.limiter:
+                endpoint.queued -= 1
+                queued = False
+                yield not endpoint.disabled and endpoint.ready_at() <= time.monotonic()
+        finally:
+            if queued:
+                endpoint.queued -= 1
+
+    def disable(self, endpoint, error):
+        """Esclude l'endpoint dopo un errore che lo riguarda, se restano altri endpoint attivi."""
+        if not isinstance(error, ENDPOINT_ERRORS):
+            return False
+        if endpoint.disabled:
+            # Richieste già in corso verso l'endpoint quando è stato escluso
+            return True
+        if not any(other is not endpoint and not other.disabled for other in self.endpoints):
+            return False
+        endpoint.disabled = True
+        print(f"Endpoint {endpoint.name} escluso ({error.__class__.__name__}): le richieste passano agli altri")
+        return True
+
+    def client(self, endpoint):
+        if endpoint.client is None:
+            base = self._clients.get(endpoint.base_url)
+            if base is None:
+                # I retry sono gestiti da GEvalAPI (vedi retry.py), non dal client OpenAI
+                base = self._clients[endpoint.base_url] = openai.OpenAI(
+                    api_key=endpoint.api_key, base_url=endpoint.base_url, max_retries=0)
+            endpoint.client = base.with_options(api_key=endpoint.api_key)
+        return endpoint.client
+
+    def async_client(self, endpoint):
+        if endpoint.async_client is None:
+            base = self._async_clients.get(endpoint.base_url)
+            if base is None:
+                base = self._async_clients[endpoint.base_url] = openai.AsyncOpenAI(
+                    api_key=endpoint.api_key, base_url=endpoint.base_url, max_retries=0)
+            endpoint.async_client = base.with_options(api_key=endpoint.api_key)
+        return endpoint.async_client
+
+    def run(self, coroutine):
+        """
+        Esegue la coroutine nell'event loop del pool, che resta aperto tra una chiamata e l'altra
+        (i client asincroni sono legati al loop). Come `asyncio.run`, al termine annulla i task rimasti.
+        """
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        try:
+            return self._loop.run_until_complete(coroutine)
+        finally:
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+    def close(self):
+        for client in self._clients.values():
+            client.close()
+        if self._loop is not None and not self._loop.is_closed():
+            async def close_async_clients():
+                await asyncio.gather(*(client.close() for client in self._async_clients.values()))
+
+            self._loop.run_until_complete(close_async_clients())
+            self._loop.close()
+        self._clients, self._async_clients = {}, {}
+        for endpoint in self.endpoints:
+            endpoint.client = endpoint.async_client = None
+
+
+def load_endpoints(path, base_url=None, max_concurrency=8, placeholder_key=None):
+    """
+    Legge gli endpoint da un file JSON: una lista (oppure {"endpoints": [...]}) di oggetti con `api_key`
+    (o `api_key_env`, nome della variabile d'ambiente che la contiene) e, opzionali, `base_url`, `name`,
+    `weight`, `max_concurrency`, `requests_per_minute` e `model`. `base_url` e `max_concurrency` mancanti
+    prendono i valori indicati. Con `placeholder_key` (es. dry run) una variabile d'ambiente non impostata
+    non è un errore e l'endpoint usa quella chiave fittizia.
+    """
+    with open(path, "r") as f:
+        config = json.load(f)
+    entries = config.get("endpoints", []) if isinstance(config, dict) else config
+    endpoints = []
+    for entry in entries:
+        entry = dict(entry)
+        if "api_key_env" in entry:
+            variable = entry.pop("api_key_env")
+            entry["api_key"] = os.getenv(variable) or placeholder_key
+            if not entry["api_key"]:
+                raise ValueError(f"Variabile d'ambiente {variable} non impostata (endpoint in {path}).")
+        entry.setdefault("base_url", base_url)
+        entry.setdefault("max_concurrency", max_concurrency)
+        endpoints.append(Endpoint(**entry))
+    if not endpoints:
+        raise ValueError(f"Nessun endpoint configurato in {path}.")
+    return endpoints
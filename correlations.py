@@ -0,0 +1,215 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import kendalltau, rankdata
+from evaluators.common import result_key
+from results_io import read_frame, read_results, results_format
+
+METHODS = ("pearson", "spearman", "kendall")
+
+# Numero massimo di valori per blocco di ricampionamento (limita la memoria dei bootstrap vettorizzati)
+_BLOCK_VALUES = 2_000_000
+
+
+def results_frame(data, keep_prompt=False):
+    """
+    Converte una lista di risultati in un DataFrame colonnare.
+
+    I campi annidati vengono appiattiti con "." (es. "evaluation.Overall", "human_scores.Engaging") e
+    ogni riga riceve una colonna "key" stabile (vedi `result_key`) per confrontare file diversi.
+    Il prompt viene scartato a meno che `keep_prompt` sia True.
+    """
+    records = [entry if keep_prompt else {k: v for k, v in entry.items() if k != "prompt"} for entry in data]
+    frame = pd.json_normalize(records, sep=".")
+    frame["key"] = [result_key(entry) for entry in data]
+    for column in frame.columns:
+        if column == "overall_score" or column.split(".")[0] in ("evaluation", "human_scores", "score_variance"):
+            frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    return frame
+
+
+def load_results(file_path, keep_prompt=False, columns=None):
+    """
+    Carica un file di risultati (.json, .jsonl.gz o .parquet) come DataFrame colonnare.
+
+    Args:
+        columns (list[str], opzionale): Colonne da caricare, come nomi esatti o prefissi che terminano
+            con "." (es. "evaluation."). Dai file Parquet vengono lette solo queste colonne.
+    """
+    if results_format(file_path) == "parquet" and not keep_prompt:
+        return read_frame(file_path, columns)
+    frame = results_frame(read_results(file_path, keep_prompt), keep_prompt)
+    if columns is None:
+        return frame
+    return frame[[name for name in frame.columns
+                  if name in columns or any(prefix.endswith(".") and name.startswith(prefix) for prefix in columns)]]
+
+
+def analysis_columns(group_by=None):
+    """Colonne necessarie per correlazioni, raggruppamenti e confronti tra file."""
+    return ["key", "overall_score", "evaluation.", "human_scores.", *(group_by or [])]
+
+
+def score_columns(dimension="Overall"):
+    """Colonne (punteggio umano, punteggio del modello) per la dimensione indicata."""
+    if dimension == "Overall":
+        return "overall_score", "evaluation.Overall"
+    return f"human_scores.{dimension}", f"evaluation.{dimension}"
+
+
+def _pearson_rows(x, y):
+    """Correlazione di Pearson riga per riga tra due matrici (o vettori riga) broadcastabili."""
+    xm = x - x.mean(axis=1, keepdims=True)
+    ym = y - y.mean(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (xm * ym).sum(axis=1) / np.sqrt((xm ** 2).sum(axis=1) * (ym ** 2).sum(axis=1))
+
+
+def _correlation_rows(method, x, y):
+    if method == "pearson":
+        return _pearson_rows(x, y)
+    if method == "spearman":
+        return _pearson_rows(rankdata(x, axis=1), rankdata(y, axis=1))
+    # Kendall tau-b non ha una forma vettorizzata efficiente: scipy è O(n log n) per riga
+    x, y = np.broadcast_arrays(x, y)
+    return np.array([kendalltau(a, b)[0] for a, b in zip(x, y)])
+
+
+def _block_rows(n_rows, n_values):
+    return max(1, min(n_rows, _BLOCK_VALUES // max(1, n_values)))
+
+
+def bootstrap_ci(x, y, n_bootstrap=1000, confidence=0.95, methods=METHODS, seed=None):
+    """
+    Intervalli di confidenza bootstrap (percentili) delle correlazioni tra x e y.
+    I ricampionamenti vengono calcolati a blocchi di matrici (ricampionamenti x n).
+
+    Returns:
+        dict: {metodo: (limite inferiore, limite superiore)}
+    """
+    rng = np.random.default_rng(seed)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    samples = {method: [] for method in methods}
+    block = _block_rows(n_bootstrap, len(x))
+    for start in range(0, n_bootstrap, block):
+        indices = rng.integers(0, len(x), size=(min(block, n_bootstrap - start), len(x)))
+        for method in methods:
+            samples[method].append(_correlation_rows(method, x[indices], y[indices]))
+    alpha = (1 - confidence) / 2
+    return {
+        method: tuple(np.nanpercentile(np.concatenate(values), [100 * alpha, 100 * (1 - alpha)]))
+        for method, values in samples.items()
+    }
+
+
+def correlation_table(frame, dimension="Overall", group_by=None, n_bootstrap=0, confidence=0.95, seed=None):
+    """
+    Calcola Pearson, Spearman e Kendall-Tau tra punteggi umani e del modello, eventualmente per gruppo.
+
+    Args:
+        frame (pd.DataFrame): Risultati prodotti da `results_frame` / `load_results`.
+        dimension (str): Dimensione da correlare.
+        group_by (list[str], opzionale): Colonne di raggruppamento (es. ["system"], ["level"]).
+        n_bootstrap (int): Numero di ricampionamenti per gli intervalli di confidenza (0 per non calcolarli).
+        confidence (float): Livello di confidenza degli intervalli.
+        seed (int, opzionale): Seed del bootstrap.
+
+    Returns:
+        pd.DataFrame: Una riga per gruppo con n, le tre correlazioni e, se richiesti, i limiti "<metodo>_low/high".
+    """
+    human_column, model_column = score_columns(dimension)
+    if human_column not in frame or model_column not in frame:
+        return pd.DataFrame()
+    frame = frame[frame[human_column].notna() & frame[model_column].notna()]
+    group_by = list(group_by or [])
+    groups = frame.groupby(group_by, dropna=False, sort=True) if group_by else [((), frame)]
+
+    rows = []
+    for key, group in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        row = dict(zip(group_by, key))
+        x = group[human_column].to_numpy(dtype=float)
+        y = group[model_column].to_numpy(dtype=float)
+        row["n"] = len(x)
+        for method in METHODS:
+            row[method] = _correlation_rows(method, x[None, :], y[None, :])[0] if len(x) >= 2 else np.nan
+        if n_bootstrap and len(x) >= 2:
+            for method, (low, high) in bootstrap_ci(x, y, n_bootstrap, confidence, seed=seed).items():
+                row[f"{method}_low"], row[f"{method}_high"] = low, high
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def permutation_test(frame_a, frame_b, dimension="Overall", method="spearman", n_permutations=10000, seed=None):
+    """
+    Test di permutazione accoppiato sulla differenza di correlazione con i giudizi umani tra due
+    file di risultati, calcolato sugli elementi comuni (stessa "key"). A ogni permutazione i punteggi
+    dei due modelli vengono scambiati elemento per elemento con probabilità 1/2.
+
+    Returns:
+        dict: n, correlazione di A e di B, differenza osservata e p-value bilaterale.
+    """
+    human_column, model_column = score_columns(dimension)
+    if human_column not in frame_a or model_column not in frame_a or model_column not in frame_b:
+        raise ValueError(f"Punteggi '{dimension}' mancanti in uno dei file di risultati da confrontare.")
+    # La key include dialog_id: si scartano solo le copie dello stesso record (es. file concatenati)
+    merged = frame_a[["key", human_column, model_column]].drop_duplicates("key").merge(
+        frame_b[["key", model_column]].drop_duplicates("key"), on="key", suffixes=("_a", "_b")
+    ).dropna()
+    human = merged[human_column].to_numpy(dtype=float)[None, :]
+    model_a = merged[f"{model_column}_a"].to_numpy(dtype=float)
+    model_b = merged[f"{model_column}_b"].to_numpy(dtype=float)
+
+    correlation_a = _correlation_rows(method, human, model_a[None, :])[0]
+    correlation_b = _correlation_rows(method, human, model_b[None, :])[0]
+    observed = correlation_a - correlation_b
+
+    rng = np.random.default_rng(seed)
+    extreme = 0
+    block = _block_rows(n_permutations, len(model_a))
+    for start in range(0, n_permutations, block):
+        swap = rng.random((min(block, n_permutations - start), len(model_a))) < 0.5
+        permuted_a = np.where(swap, model_b, model_a)
+        permuted_b = np.where(swap, model_a, model_b)
+        differences = _correlation_rows(method, human, permuted_a) - _correlation_rows(method, human, permuted_b)
+        extreme += np.count_nonzero(np.abs(differences) >= abs(observed) - 1e-12)
+
+    return {
+        "n": len(model_a),
+        "correlation_a": correlation_a,
+        "correlation_b": correlation_b,
+        "difference": observed,
+        "p_value": (extreme + 1) / (n_permutations + 1),
+    }
+
+
+def calculate_correlations(data, dimension="Overall"):
+    """
+    Calcola le correlazioni tra il punteggio umano e evaluation[dimension].
+    Per "Overall" il punteggio umano è overall_score, per le altre dimensioni human_scores[dimension].
+
+    Args:
+        data (list[dict] | pd.DataFrame): Risultati, come lista o come DataFrame di `load_results`.
+
+    Returns:
+        tuple: (pearson, spearman, kendall)
+    """
+    frame = data if isinstance(data, pd.DataFrame) else results_frame(data)
+    table = correlation_table(frame, dimension)
+    return tuple(table.iloc[0][list(METHODS)]) if not table.empty else (np.nan, np.nan, np.nan)
+
+
+def calculate_dimension_correlations(data):
+    """
+    Calcola le correlazioni per ogni dimensione valutata in modalità multi-dimensione.
+
+    Returns:
+        dict: {dimensione: (pearson, spearman, kendall)} per le dimensioni con almeno due coppie di punteggi.
+    """
+    frame = data if isinstance(data, pd.DataFrame) else results_frame(data)
+    dimensions = [column.split(".", 1)[1] for column in frame.columns if column.startswith("human_scores.")]
+    correlations = {}
+    for dimension in dimensions:
+        table = correlation_table(frame, dimension)
+        if not table.empty and table.iloc[0]["n"] >= 2:
+            correlations[dimension] = tuple(table.iloc[0][list(METHODS)])
+    return correlations
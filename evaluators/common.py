@@ -0,0 +1,609 @@
+import bisect
+import functools
+import hashlib
+import json
+import math
+import os
+import re
+from collections import defaultdict
+from evaluators.context_window import window_turns
+from planning import DryRun, plan_requests, print_plan, prompt_key
+from results_io import results_format, write_results
+
+USR_DIMENSIONS = ["Understandable", "Natural", "Maintains Context", "Engaging", "Uses Knowledge", "Overall"]
+
+DIMENSIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts", "dimensions.json")
+
+# Numero di alternative richieste per token in modalità logprobs
+TOP_LOGPROBS = 10
+
+# Token massimi per punteggio in modalità JSON ("Overall": 3, ...) oltre alle parentesi
+JSON_TOKENS_PER_SCORE = 8
+# Nuove richieste al massimo per ogni risultato la cui risposta non contiene tutti i punteggi
+MAX_REASKS = 1
+
+# Un punteggio: intero o decimale; "2." o "2/5" vengono letti come 2
+_NUMBER = r"(\d+(?:\.\d+)?)"
+# Dopo il nome: intervallo facoltativo come nei criteri del template ("Overall Quality (1-3): 2") e separatore
+_SEPARATOR = r"(?:\s*\(\s*\d+\s*[-–]\s*\d+\s*\))?[^\w\n]*?[:=-][^\w\n]*?"
+_BARE_SCORE = re.compile(rf"\W*{_NUMBER}\W*")
+_BATCH_SCORE = re.compile(rf"^\W*Response\s*(\d+)\W+Overall(?:\s+Quality)?{_SEPARATOR}{_NUMBER}",
+                          re.IGNORECASE | re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=None)
+def score_pattern(dimension):
+    """
+    Grammatica (compilata una volta per dimensione) di un punteggio "<Dimensione>[ Quality]: <score>":
+    a inizio riga, con articolo, markdown e punteggiatura tollerati ("**Overall Quality:** 2.", "- Overall = 2/3",
+    "The Overall Quality - 2", "Overall Quality (1-3): 2"), oppure come chiave JSON ({"Overall": 2, "Coherence": "3"}).
+    """
+    prefix = r"(?:^[^\w\n]*(?:(?:the|an?)\s+)?|\")"
+    return re.compile(rf"{prefix}{re.escape(dimension)}(?:\s+Quality)?{_SEPARATOR}{_NUMBER}",
+                      re.IGNORECASE | re.MULTILINE)
+
+
+def _number(text):
+    return float(text) if "." in text else int(text)
+
+
+def find_score(text, dimension, only=False):
+    """
+    Ultima occorrenza del punteggio di `dimension` in `text` (il valore è nel gruppo 1 del match).
+    Con `only` (unica dimensione richiesta) è accettata anche una risposta composta dal solo numero.
+    """
+    match = None
+    for match in score_pattern(dimension).finditer(text or ""):
+        pass
+    if match is None and only:
+        match = _BARE_SCORE.fullmatch(text or "")
+    return match
+
+
+def _match_scores(evaluation, dimensions):
+    scores = {}
+    for dimension in dimensions:
+        match = find_score(evaluation, dimension, only=len(dimensions) == 1)
+        scores[dimension] = _number(match.group(1)) if match else None
+    return scores
+
+
+def parse_scores(evaluations, dimensions):
+    """
+    Estrae i punteggi delle dimensioni dalle risposte del modello, in formato testo ("<Dimensione>: <score>",
+    una per riga) o JSON. L'ultima risposta valida prevale; le dimensioni non trovate restano a None.
+    """
+    scores = {dimension: None for dimension in dimensions}
+    for evaluation in evaluations:
+        for dimension, score in _match_scores(evaluation, dimensions).items():
+            if score is not None:
+                scores[dimension] = score
+    return scores
+
+
+def json_instruction(dimensions):
+    """Istruzione aggiunta ai prompt in modalità JSON (la parola "JSON" è richiesta dall'API)."""
+    fields = ", ".join(f'"{dimension}": <score>' for dimension in dimensions)
+    return f"Respond only with a JSON object, without explanations: {{{fields}}}"
+
+
+def reask_instruction(dimensions, output_format="text"):
+    """Messaggio della nuova richiesta per una risposta in cui mancano dei punteggi."""
+    if output_format == "json":
+        return "Your previous answer could not be parsed. " + json_instruction(dimensions)
+    lines = "\n".join(f"{dimension}: <score>" for dimension in dimensions)
+    return f"Your previous answer could not be parsed. Reply only with the scores, in this format:\n{lines}"
+
+
+def _messages(prompt):
+    return [dict(message) for message in prompt] if isinstance(prompt, list) else [{"role": "system", "content": prompt}]
+
+
+def with_instruction(prompt, instruction):
+    """Aggiunge `instruction` in coda all'ultimo messaggio: il prefisso del prompt (e la prompt cache) non cambia."""
+    messages = _messages(prompt)
+    messages[-1]["content"] += f"\n\n{instruction}"
+    return messages
+
+
+def reask_prompt(prompt, answer, instruction):
+    """Conversazione della nuova richiesta: il prompt, la risposta non interpretabile e la richiesta di formato."""
+    messages = _messages(prompt)
+    if answer:
+        messages.append({"role": "assistant", "content": answer})
+    messages.append({"role": "user", "content": instruction})
+    return messages
+
+
+def answer_text(evaluations):
+    """Testo della prima risposta non vuota (le risposte con logprob sono dizionari)."""
+    for evaluation in evaluations:
+        text = evaluation.get("content") if isinstance(evaluation, dict) else evaluation
+        if text:
+            return text
+    return None
+
+
+def _moments(distribution):
+    """Valore atteso e varianza di una distribuzione {punteggio: peso} (i pesi vengono normalizzati)."""
+    total = sum(distribution.values())
+    mean = sum(score * weight for score, weight in distribution.items()) / total
+    variance = sum(weight * (score - mean) ** 2 for score, weight in distribution.items()) / total
+    return mean, variance
+
+
+def weighted_scores_from_logprobs(choice, dimensions):
+    """
+    Calcola il punteggio atteso di ogni dimensione pesando i token-punteggio alternativi
+    con le loro probabilità (top_logprobs) nella posizione in cui il modello ha scritto il punteggio.
+
+    Returns:
+        tuple(dict, dict): Punteggi attesi e varianze per dimensione, oppure (None, None)
+        se la risposta non contiene logprob.
+    """
+    tokens = choice.get("logprobs")
+    if not tokens:
+        return None, None
+
+    content = ""
+    starts = []
+    for token, _ in tokens:
+        starts.append(len(content))
+        content += token
+
+    scores, variances = {}, {}
+    for dimension in dimensions:
+        match = find_score(content, dimension, only=len(dimensions) == 1)
+        if not match:
+            scores[dimension], variances[dimension] = None, None
+            continue
+        position = bisect.bisect_right(starts, match.start(1)) - 1
+        distribution = defaultdict(float)
+        for alternative, logprob in tokens[position][1]:
+            digits = re.fullmatch(r"\W*(\d+)\W*", alternative)
+            if digits:
+                distribution[int(digits.group(1))] += math.exp(logprob)
+        if not distribution:
+            distribution[_number(match.group(1))] = 1.0
+        scores[dimension], variances[dimension] = _moments(distribution)
+    return scores, variances
+
+
+def weighted_scores_from_samples(evaluations, dimensions):
+    """Calcola punteggio atteso e varianza di ogni dimensione dalla distribuzione empirica di n campioni."""
+    distributions = {dimension: defaultdict(float) for dimension in dimensions}
+    for evaluation in evaluations:
+        for dimension, score in _match_scores(evaluation, dimensions).items():
+            if score is not None:
+                distributions[dimension][score] += 1
+    scores, variances = {}, {}
+    for dimension, distribution in distributions.items():
+        scores[dimension], variances[dimension] = _moments(distribution) if distribution else (None, None)
+    return scores, variances
+
+
+def score_evaluations(evaluations, dimensions, mode="single"):
+    """
+    Punteggi (e varianze, nelle modalità pesate) delle dimensioni secondo lo scoring `mode`.
+
+    Returns:
+        tuple(dict, dict | None): (None, None) in modalità "logprobs" se la risposta non contiene logprob.
+    """
+    if mode == "single":
+        return parse_scores(evaluations, dimensions), None
+    if mode == "logprobs" and not isinstance(evaluations[0], str):
+        return weighted_scores_from_logprobs(evaluations[0], dimensions)
+    # In modalità logprobs, le risposte di un endpoint senza logprob sono già campioni (vedi GEvalAPI.asend_request)
+    return weighted_scores_from_samples(evaluations, dimensions)
+
+
+def scoring_options(scoring="single", num_samples=20, output_format="text", num_scores=1):
+    """
+    Parametri delle richieste per lo scoring e il formato indicati.
+
+    Returns:
+        tuple(dict, dict, dict): Opzioni della richiesta principale, del fallback a campioni (logprob non
+        disponibili) e delle nuove richieste per le risposte con punteggi mancanti.
+    """
+    format_options = {}
+    if output_format == "json":
+        max_tokens = 4 + JSON_TOKENS_PER_SCORE * num_scores
+        format_options = dict(response_format={"type": "json_object"})
+    else:
+        # Circa 12 token per riga "<Dimensione>: <score>" in modalità multi-dimensione
+        max_tokens = max(50, 12 * num_scores)
+    sample_options = dict(n=num_samples, temperature=1, max_tokens=max_tokens, **format_options)
+    request_options = {
+        "single": dict(max_tokens=max_tokens, **format_options),
+        "logprobs": dict(max_tokens=max_tokens, top_logprobs=TOP_LOGPROBS, **format_options),
+        "samples": sample_options,
+    }[scoring]
+    return request_options, sample_options, dict(max_tokens=max_tokens, **format_options)
+
+
+def format_prompt(prompt, dimensions, output_format="text"):
+    """Prompt da inviare: in modalità JSON con l'istruzione sul formato in coda."""
+    if output_format == "json":
+        return with_instruction(prompt, json_instruction(dimensions))
+    return prompt
+
+
+def mean_score(scores):
+    """Media delle annotazioni numeriche; le annotazioni testuali (es. "N/A (...)" in FED) sono ignorate."""
+    scores = [score for score in scores if isinstance(score, (int, float))]
+    return sum(scores) / len(scores) if scores else None
+
+
+def resolve_dimensions(requested, available, known=None):
+    """
+    Restituisce le dimensioni da valutare tra quelle annotate nel dataset.
+
+    Args:
+        requested (list[str] | None): Dimensioni richieste; None per il solo Overall, ["all"] per tutte.
+        available (list[str]): Dimensioni annotate nel dataset (o nel livello) corrente.
+        known (list[str] | None): Tutte le dimensioni valide del dataset (es. entrambi i livelli FED);
+            None se coincidono con `available`.
+
+    Raises:
+        ValueError: Se una dimensione richiesta non è annotata nel dataset.
+    """
+    if not requested:
+        return ["Overall"]
+    if requested == ["all"]:
+        return list(available)
+    unknown = [dimension for dimension in requested if dimension not in (known or available)]
+    if unknown:
+        raise ValueError(f"Dimensioni sconosciute: {', '.join(unknown)}. "
+                         f"Dimensioni disponibili: {', '.join(known or available)}")
+    return [dimension for dimension in available if dimension in requested]
+
+
+def build_multi_template(template, dimensions, definitions_path=DIMENSIONS_PATH):
+    """
+    Compila un template multi-dimensione sostituendo {{dimensions}} con i criteri
+    e {{format}} con il formato di risposta atteso, una riga per dimensione.
+    """
+    if "{{dimensions}}" not in template:
+        raise ValueError("Il template non supporta la valutazione multi-dimensione (manca {{dimensions}}).")
+    with open(definitions_path, "r") as f:
+        definitions = json.load(f)
+    criteria = "\n".join(f"- {dimension}: {definitions.get(dimension, '')}".rstrip() for dimension in dimensions)
+    response_format = "\n".join(f"{dimension}: <score>" for dimension in dimensions)
+    return template.replace("{{dimensions}}", criteria).replace("{{format}}", response_format)
+
+
+def result_key(result):
+    """
+    Chiave stabile di un risultato: hash di livello, sistema, `dialog_id` (indice del record nel dataset) e
+    risposta, così record con lo stesso testo restano distinti. Senza `dialog_id` (es. servizio di valutazione)
+    l'hash usa il contesto al posto dell'indice.
+    """
+    dialog_id = result.get("dialog_id")
+    if dialog_id is not None:
+        fields = ["dialog_id", result.get("level"), result.get("system"), int(dialog_id), result.get("response")]
+    else:
+        fields = [result.get("level"), result.get("system"), result.get("context"), result.get("response")]
+    payload = json.dumps(fields, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def checkpoint_path(output_path):
+    return output_path + ".jsonl"
+
+
+def load_checkpoint(path):
+    """Legge i risultati già completati da un checkpoint JSONL, ignorando un'eventuale riga troncata."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[entry["key"]] = entry["result"]
+    return done
+
+
+def format_batch_responses(responses):
+    """Numera le risposte candidate di un prompt batch ("Response 1: ...", "Response 2: ...")."""
+    return "\n\n".join(f"Response {slot}: {response}" for slot, response in enumerate(responses, 1))
+
+
+def parse_batch_scores(evaluations, num_slots):
+    """
+    Estrae i punteggi da una risposta batch nel formato "Response <n> - Overall Quality: <score>".
+
+    Returns:
+        dict: {numero della risposta (da 1): punteggio} solo per le risposte trovate.
+    """
+    scores = {}
+    for evaluation in evaluations:
+        for match in _BATCH_SCORE.finditer(evaluation):
+            slot = int(match.group(1))
+            if 1 <= slot <= num_slots:
+                scores[slot] = _number(match.group(2))
+    return scores
+
+
+def run_evaluations(g_eval, results, output_path, resume=False, scoring="single", num_samples=20, batches=None,
+                    dry_run=False, keep_prompts=False, output_format="text", max_reasks=MAX_REASKS):
+    """
+    Invia i prompt dei risultati, salva ogni valutazione in un checkpoint JSONL appena completata
+    e al termine compatta il checkpoint nel file JSON di output.
+
+    Prima di ogni richiesta stampa il piano di esecuzione (vedi `planning.plan_requests`); i prompt
+    identici vengono inviati una sola volta e la risposta viene assegnata a tutti i risultati corrispondenti.
+
+    Args:
+        g_eval (GEvalAPI): Oggetto GEvalAPI per l'invio delle richieste.
+        results (list[dict]): Risultati con il campo "prompt" e "evaluation" da completare.
+        output_path (str): Percorso del file finale; il formato dipende dall'estensione (.json, .jsonl.gz o
+            .parquet, vedi `results_io.write_results`).
+        resume (bool): Se True salta i risultati già presenti nel checkpoint.
+        scoring (str): "single" usa il punteggio discreto della risposta; "logprobs" il punteggio atteso
+            pesato con le probabilità dei token (con fallback su "samples" se l'endpoint non restituisce
+            logprob); "samples" il punteggio medio di `num_samples` risposte ottenute con una sola richiesta.
+        num_samples (int): Numero di risposte per richiesta in modalità "samples".
+        batches (list[tuple], opzionale): Coppie (prompt, indici dei risultati) che valutano più risultati con
+            una sola richiesta (solo Overall con scoring "single"). I risultati mancanti nella risposta batch
+            vengono poi valutati singolarmente con il proprio "prompt".
+        dry_run (bool): Se True si ferma dopo il piano sollevando `planning.DryRun`, senza richieste né file.
+        keep_prompts (bool): Nei formati compatti salva anche il messaggio user di ogni prompt.
+        output_format (str): "text" per il formato di risposta del template; "json" chiede un oggetto JSON
+            (response_format json_object) con `max_tokens` ridotto al minimo per i punteggi richiesti.
+        max_reasks (int): Nuove richieste al massimo per i risultati la cui risposta non contiene tutti i
+            punteggi: al modello vengono rimandate la risposta e la richiesta del formato esatto. I risultati
+            ancora senza punteggio restano nell'output con valore None e vengono segnalati.
+
+    Returns:
+        list[dict]: I risultati completati, nello stesso ordine dell'input.
+    """
+    if batches and scoring != "single":
+        raise ValueError("La modalità batch supporta solo lo scoring 'single'.")
+    if batches and output_format == "json":
+        raise ValueError("La modalità batch non supporta l'output JSON.")
+    if output_format not in ("text", "json"):
+        raise ValueError(f"Formato di output non valido: {output_format}. Usa 'text' o 'json'.")
+    # Un'estensione non supportata deve fallire prima delle richieste, non al salvataggio
+    results_format(output_path)
+
+    checkpoint = checkpoint_path(output_path)
+    keys = [result_key(result) for result in results]
+    done = load_checkpoint(checkpoint) if resume else {}
+    pending = [i for i, key in enumerate(keys) if key not in done]
+
+    if done:
+        print(f"Ripresa: {len(results) - len(pending)} risultati già presenti in {checkpoint}")
+
+    num_scores = max([1] + [len(results[i]["evaluation"]) for i in pending])
+    request_options, sample_options, reask_options = scoring_options(scoring, num_samples, output_format, num_scores)
+
+    def request_prompt(result):
+        return format_prompt(result["prompt"], list(result["evaluation"]), output_format)
+
+    if batches:
+        pending_set = set(pending)
+        batches = [(prompt, slots) for prompt, slots in batches if pending_set.intersection(slots)]
+        batch_max_tokens = max([50] + [15 * len(slots) for _, slots in batches])
+        plan = plan_requests(g_eval, [prompt for prompt, _ in batches], dict(max_tokens=batch_max_tokens),
+                             max([1] + [len(slots) for _, slots in batches]))
+    else:
+        options = dict(request_options, fallback=sample_options) if scoring == "logprobs" else request_options
+        plan = plan_requests(g_eval, [request_prompt(results[i]) for i in pending], options, num_scores)
+    print_plan(plan)
+    if dry_run:
+        raise DryRun(plan)
+
+    metrics = g_eval.metrics
+    # Ultima risposta ricevuta per i risultati senza tutti i punteggi, rimandata al modello nelle nuove richieste
+    answers = {}
+
+    def missing(result):
+        return [dimension for dimension, value in result["evaluation"].items() if value is None]
+
+    def score(result, evaluations, mode):
+        with metrics.phase("parse"):
+            scores, variances = score_evaluations(evaluations, list(result["evaluation"]), mode)
+        if scores is None:
+            return False
+        metrics.record_parse(all(value is not None for value in scores.values()))
+        result["evaluation"].update(scores)
+        if variances is not None:
+            result["score_variance"] = variances
+        return True
+
+    with open(checkpoint, "a" if resume else "w") as f:
+        if f.tell() > 0:
+            # Una riga troncata da un crash non deve fondersi con la prossima
+            f.write("\n")
+
+        def write(i):
+            with metrics.phase("io"):
+                f.write(json.dumps({"key": keys[i], "result": results[i]}, ensure_ascii=False) + "\n")
+                f.flush()
+
+        if batches:
+            batched = set()
+
+            def on_batch_result(index, evaluations):
+                slots = batches[index][1]
+                with metrics.phase("parse"):
+                    scores = parse_batch_scores(evaluations, len(slots))
+                for slot, i in enumerate(slots, 1):
+                    if i in pending_set:
+                        # Le risposte mancanti vengono poi rivalutate singolarmente
+                        metrics.record_parse(scores.get(slot) is not None)
+                    if i in pending_set and scores.get(slot) is not None:
+                        results[i]["evaluation"]["Overall"] = scores[slot]
+                        write(i)
+                        batched.add(i)
+
+            g_eval.send_many([prompt for prompt, _ in batches], max_tokens=batch_max_tokens, on_result=on_batch_result)
+
+            pending = [i for i in pending if i not in batched]
+            if pending:
+                print(f"Batch: {len(pending)} risultati mancanti nelle risposte, nuovo tentativo con richieste singole")
+
+        # Prompt identici (es. stessa risposta ricampionata o ripetuta nel dataset) vengono inviati una volta sola
+        groups = defaultdict(list)
+        for i in pending:
+            groups[prompt_key(results[i]["prompt"])].append(i)
+        groups = list(groups.values())
+        fallback = []
+
+        def on_result(index, evaluations):
+            group = groups[index]
+            if not score(results[group[0]], evaluations, scoring):
+                fallback.append(group)
+                return
+            for i in group[1:]:
+                score(results[i], evaluations, scoring)
+            for i in group:
+                if missing(results[i]):
+                    answers[i] = answer_text(evaluations)
+                write(i)
+
+        # In modalità logprobs gli endpoint già noti per non restituirli ricevono subito la richiesta a campioni
+        g_eval.send_many([request_prompt(results[group[0]]) for group in groups], on_result=on_result,
+                         fallback=sample_options if scoring == "logprobs" else None, **request_options)
+
+        if fallback:
+            print(f"Logprob non disponibili per {len(fallback)} richieste: uso {num_samples} campioni per richiesta")
+
+            def on_fallback_result(index, evaluations):
+                for i in fallback[index]:
+                    score(results[i], evaluations, "samples")
+                    if missing(results[i]):
+                        answers[i] = answer_text(evaluations)
+                    write(i)
+
+            g_eval.send_many([request_prompt(results[group[0]]) for group in fallback], on_result=on_fallback_result,
+                             **sample_options)
+
+        # Nuove richieste mirate, solo per i risultati con punteggi mancanti: i punteggi già letti restano
+        for attempt in range(1, max_reasks + 1):
+            unparsed = [i for i in pending if missing(results[i])]
+            if not unparsed:
+                break
+            print(f"Punteggi non interpretabili per {len(unparsed)} risultati: nuova richiesta del formato "
+                  f"(tentativo {attempt} di {max_reasks})")
+            reasks = {}
+            for i in unparsed:
+                prompt = reask_prompt(request_prompt(results[i]), answers.get(i),
+                                      reask_instruction(missing(results[i]), output_format))
+                reasks.setdefault(prompt_key(prompt), (prompt, []))[1].append(i)
+            reasks = list(reasks.values())
+
+            def on_reask_result(index, evaluations):
+                for i in reasks[index][1]:
+                    absent = missing(results[i])
+                    with metrics.phase("parse"):
+                        scores = parse_scores(evaluations, absent)
+                    results[i]["evaluation"].update({dimension: value for dimension, value in scores.items()
+                                                     if value is not None})
+                    metrics.record_reask(not missing(results[i]))
+                    if missing(results[i]):
+                        answers[i] = answer_text(evaluations)
+                    write(i)
+
+            g_eval.send_many([prompt for prompt, _ in reasks], on_result=on_reask_result, **reask_options)
+
+    results = [done.get(key, result) for key, result in zip(keys, results)]
+    unparsed = [result for result in results if missing(result)]
+    metrics.record_unparsed(len(unparsed))
+    if unparsed:
+        # I risultati senza punteggio restano nell'output (valore None) e sono esclusi dalle correlazioni
+        print(f"Attenzione: {len(unparsed)} risultati senza punteggio dopo {max_reasks} nuove richieste, "
+              f"salvati con valore None")
+
+    with metrics.phase("io"):
+        write_results(results, output_path, keep_prompts)
+    os.remove(checkpoint)
+
+    return results
+
+
+def process_usr_data(items, g_eval, single_template_path, output_path, resume=False, dimensions=None,
+                     batch_template_path=None, batch_size=None, context_window=None, **run_options):
+    """
+    Valuta i dataset USR (tc_usr e pc_usr): ogni record ha un contesto e più risposte candidate,
+    ciascuna valutata come un risultato a sé.
+    """
+    # Import locale: correlations e shards importano questo modulo senza il client API
+    from g_eval import PromptTemplate
+
+    single_template = g_eval.load_prompt_template(single_template_path)
+
+    # Con più dimensioni una sola richiesta restituisce tutti i punteggi
+    usr_dimensions = resolve_dimensions(dimensions, USR_DIMENSIONS)
+    if dimensions:
+        single_template = build_multi_template(single_template, usr_dimensions)
+
+    # Istruzioni nel prefisso statico (system), dialogo e risposta nel messaggio user
+    single_template = PromptTemplate(single_template)
+
+    # In modalità batch le risposte di uno stesso contesto vengono valutate insieme, batch_size per richiesta
+    batch_template = None
+    if batch_size:
+        if dimensions:
+            raise ValueError("La modalità batch supporta solo la valutazione di Overall.")
+        batch_template = PromptTemplate(g_eval.load_prompt_template(batch_template_path))
+
+    results = []
+    batches = []
+
+    for dialog_id, instance in items:
+        context = instance["context"]
+        fact = instance["fact"]
+        responses = instance["responses"]
+        first = len(results)
+
+        for response_entry in responses:
+            response = response_entry["response"]
+            system = response_entry["model"]
+            overall_scores = response_entry.get("Overall", [])
+
+            overall_score = sum(overall_scores) / len(overall_scores) if overall_scores else None
+
+            conversation = context.split("\n")
+            conversation = [line.replace("User: ", "").replace("System: ", "").strip() for line in conversation]
+
+            full_conversation = " ".join(conversation) + " " + response.replace("System: ", "").strip()
+            # Il contesto completo resta nel risultato; nel prompt va solo quello della finestra
+            window, window_info = window_turns(context_window, conversation)
+            # Il fatto serve alla dimensione "Uses Knowledge" (i template che non lo usano lo ignorano)
+            prompt = g_eval.generate_prompt(single_template,
+                                            " ".join(window) + " " + response.replace("System: ", "").strip(), response,
+                                            fact)
+
+            result = {
+                "dialog_id": dialog_id,
+                "context": full_conversation,
+                "response": response if response else None,
+                "system": system,
+                "overall_score": overall_score,
+                "prompt": prompt,
+                "evaluation": {dimension: None for dimension in usr_dimensions},
+                "level": "turn-level" if response else "dialog-level"
+            }
+            if dimensions:
+                result["human_scores"] = {dimension: mean_score(response_entry.get(dimension, []))
+                                          for dimension in usr_dimensions}
+            if window_info:
+                result["context_window"] = window_info
+            results.append(result)
+
+        if batch_template:
+            for start in range(first, len(results), batch_size):
+                slots = list(range(start, min(start + batch_size, len(results))))
+                batch_responses = [responses[i - first]["response"].replace("System: ", "").strip() for i in slots]
+                prompt = g_eval.generate_prompt(batch_template, " ".join(window),
+                                                format_batch_responses(batch_responses))
+                batches.append((prompt, slots))
+
+    results = run_evaluations(g_eval, results, output_path, resume, batches=batches or None, **run_options)
+    print(f"Risultati salvati in {output_path}")
+
+    return results
@@ -0,0 +1,102 @@
+from planning import count_text_tokens
+
+TRUNCATION_MARKER = "[...]"
+
+
+class ContextWindow:
+    """
+    Riduce il contesto di un dialogo prima di inserirlo nel prompt.
+
+    - `last_turns`: conserva solo gli ultimi K turni (più il primo, se `keep_first`);
+    - `max_tokens`: budget di token del contesto; i turni centrali vengono sostituiti da `marker`
+      e, se anche un singolo turno supera il budget, viene troncato al centro. Il budget deve contenere
+      almeno tre marker (primo turno troncato, turni rimossi, ultimo turno troncato).
+
+    I token sono contati con `planning.count_text_tokens` (tiktoken se installato).
+    """
+
+    def __init__(self, max_tokens=None, last_turns=None, keep_first=True, marker=TRUNCATION_MARKER,
+                 model="gpt-4o-mini"):
+        self.max_tokens = max_tokens
+        self.last_turns = last_turns
+        self.keep_first = keep_first
+        self.marker = marker
+        self.model = model
+        if max_tokens is not None and max_tokens < 3 * count_text_tokens(marker, model):
+            raise ValueError(f"max_tokens deve essere almeno {3 * count_text_tokens(marker, model)} "
+                             f"(tre volte i token del marker {marker!r}).")
+
+    def _tokens(self, turns):
+        return sum(count_text_tokens(turn, self.model) for turn in turns)
+
+    def _truncate_turn(self, turn, budget):
+        """Tronca un turno al centro (inizio e fine, separati dal marker) entro `budget` token."""
+        if count_text_tokens(turn, self.model) <= budget:
+            return turn
+        # Ricerca binaria del numero di caratteri da conservare a ciascun estremo
+        low, high = 0, len(turn) // 2
+        while low < high:
+            keep = (low + high + 1) // 2
+            candidate = f"{turn[:keep]} {self.marker} {turn[len(turn) - keep:]}"
+            if count_text_tokens(candidate, self.model) <= budget:
+                low = keep
+            else:
+                high = keep - 1
+        return f"{turn[:low]} {self.marker} {turn[len(turn) - low:]}" if low else self.marker
+
+    def apply(self, turns):
+        """
+        Returns:
+            tuple(list[str], dict): I turni da usare nel prompt e le informazioni sul troncamento
+            (turni e token originali e conservati, token rimossi).
+        """
+        original_tokens = self._tokens(turns)
+        truncated_turns = 0
+        head = turns[:1] if self.keep_first and len(turns) > 1 else []
+        tail = turns[len(head):]
+
+        if self.last_turns is not None and len(tail) > self.last_turns:
+            tail = [self.marker] + (tail[-self.last_turns:] if self.last_turns else [])
+
+        if self.max_tokens is not None and self._tokens(head + tail) > self.max_tokens:
+            budget = self.max_tokens - self._tokens(head) - count_text_tokens(self.marker, self.model)
+            kept = []
+            for turn in reversed([turn for turn in tail if turn != self.marker]):
+                if self._tokens(kept) + count_text_tokens(turn, self.model) > budget:
+                    break
+                kept.insert(0, turn)
+            if not kept:
+                # Nemmeno l'ultimo turno rientra nel budget: ne conserva inizio e fine, lasciando
+                # spazio al marker dei turni rimossi
+                available = self.max_tokens
+                if len([turn for turn in tail if turn != self.marker]) > 1 or self.marker in tail:
+                    available -= count_text_tokens(self.marker, self.model)
+                if head and self._tokens(head) > available // 2:
+                    truncated = self._truncate_turn(head[0], available // 2)
+                    truncated_turns += truncated != head[0]
+                    head = [truncated]
+                if tail:
+                    truncated = self._truncate_turn(tail[-1], available - self._tokens(head))
+                    truncated_turns += truncated != tail[-1]
+                    kept = [truncated]
+            if len(kept) < len([turn for turn in tail if turn != self.marker]) or self.marker in tail:
+                kept.insert(0, self.marker)
+            tail = kept
+
+        windowed = head + tail
+        kept_tokens = self._tokens(windowed)
+        return windowed, {
+            "turns": len(turns),
+            # I turni troncati al centro non contano come conservati
+            "kept_turns": len([turn for turn in windowed if turn != self.marker]) - truncated_turns,
+            "tokens": original_tokens,
+            "kept_tokens": kept_tokens,
+            "truncated_tokens": max(0, original_tokens - kept_tokens),
+        }
+
+
+def window_turns(context_window, turns):
+    """Applica `context_window` (se presente) ai turni; restituisce (turni, informazioni o None)."""
+    if context_window is None:
+        return turns, None
+    return context_window.apply(turns)
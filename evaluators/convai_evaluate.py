@@ -1,55 +1,51 @@
-import json
-from g_eval import GEvalAPI
-import time
+from g_eval import PromptTemplate
+from evaluators.common import run_evaluations
+from evaluators.context_window import window_turns
 
-def process_convai_data(file_path, g_eval, single_template_path, output_path):
+def process_convai_data(items, g_eval, single_template_path, output_path, resume=False, context_window=None,
+                        **run_options):
     """
     Processa il dataset ConvAI2 per valutare la qualità delle risposte nei dialoghi.
 
     Args:
-        file_path (str): Percorso del file JSON di input.
+        items (iterable): Coppie (indice, record) del dataset, prodotte da `loaders.load_dataset`.
         g_eval (GEvalAPI): Oggetto GEvalAPI per la generazione e valutazione.
         single_template_path (str): Percorso del template per la valutazione.
         output_path (str): Percorso per salvare i risultati.
+        resume (bool): Se True riprende da un checkpoint esistente saltando i risultati già calcolati.
+        context_window (ContextWindow, opzionale): Finestra applicata ai turni del dialogo nel prompt.
+        run_options: Opzioni inoltrate a `run_evaluations` (es. scoring, num_samples).
     """
     single_template = g_eval.load_prompt_template(single_template_path)
-
-    with open(file_path, "r") as f:
-        data = json.load(f)
+    # Istruzioni nel prefisso statico (system), dialogo e risposta nel messaggio user
+    single_template = PromptTemplate(single_template)
 
     results = []
 
-    for dialog_id, example in enumerate(data):
+    for dialog_id, example in items:
         dialog = example['dialog']
         eval_score = example['eval_score']
 
         if len(dialog) > 1 and eval_score is not None:
             dialog_text = "\n".join([turn['text'] for turn in dialog])
-            prompt = g_eval.generate_prompt(single_template, dialog_text, "")
-
-            evaluations = g_eval.send_request(prompt)
-
-            overall = None
-            for evaluation in evaluations:
-                if "Overall" in evaluation and ":" in evaluation:
-                    try:
-                        overall = int(evaluation.split(":")[1].strip())
-                    except ValueError:
-                        print(f"Errore nel parsing di Overall: {evaluation}")
+            window, window_info = window_turns(context_window, [turn['text'] for turn in dialog])
+            prompt = g_eval.generate_prompt(single_template, "\n".join(window), "")
 
-            results.append({
+            result = {
                 "dialog_id": dialog_id,
                 "context": dialog_text,
                 "overall_score": eval_score,
                 "prompt": prompt,
                 "evaluation": {
-                    "Overall": overall,
+                    "Overall": None,
                 },
                 "level": "dialog-level"
-            })
+            }
+            if window_info:
+                result["context_window"] = window_info
+            results.append(result)
 
-    with open(output_path, "w") as f:
-        json.dump(results, f, indent=4)
+    results = run_evaluations(g_eval, results, output_path, resume, **run_options)
     print(f"Risultati ConvAI2 salvati in {output_path}")
 
     return results
\ No newline at end of file
@@ -1,54 +1,50 @@
-import json
-from g_eval import GEvalAPI
-import time
+from g_eval import PromptTemplate
+from evaluators.common import run_evaluations
+from evaluators.context_window import window_turns
 
-def process_dstc_data(file_path, g_eval, single_template_path, output_path):
+def process_dstc_data(items, g_eval, single_template_path, output_path, resume=False, context_window=None,
+                      **run_options):
     """
     Processa il dataset DSTC per valutare le risposte fornite nei dialoghi.
     
     Args:
-        file_path (str): Percorso del file JSON di input.
+        items (iterable): Coppie (indice, record) del dataset, prodotte da `loaders.load_dataset`.
         g_eval (GEvalAPI): Oggetto GEvalAPI per la generazione e valutazione.
         single_template_path (str): Percorso del template per la valutazione.
         output_path (str): Percorso per salvare i risultati.
+        resume (bool): Se True riprende da un checkpoint esistente saltando i risultati già calcolati.
+        context_window (ContextWindow, opzionale): Finestra applicata ai turni del contesto nel prompt.
+        run_options: Opzioni inoltrate a `run_evaluations` (es. scoring, num_samples).
     """
     single_template = g_eval.load_prompt_template(single_template_path)
-
-    with open(file_path, "r") as f:
-        data = json.load(f)
+    # Istruzioni nel prefisso statico (system), dialogo e risposta nel messaggio user
+    single_template = PromptTemplate(single_template)
 
     results = []
 
-    for i, instance in enumerate(data['contexts']):
-        context = " ".join(instance)
-        response = data["responses"][i]
-        overall_score = data["scores"][i]
-
-        prompt = g_eval.generate_prompt(single_template, context, response)
-        evaluations = g_eval.send_request(prompt)
-
-        overall = None
-        for evaluation in evaluations:
-            if "Overall" in evaluation and ":" in evaluation:
-                try:
-                    overall = int(evaluation.split(":")[1].strip())
-                except ValueError:
-                    print(f"Errore nel parsing di Overall: {evaluation}")
+    for i, instance in items:
+        context = " ".join(instance["context"])
+        response = instance["response"]
+        overall_score = instance["score"]
 
-        results.append({
+        window, window_info = window_turns(context_window, instance["context"])
+        prompt = g_eval.generate_prompt(single_template, " ".join(window), response)
+        result = {
             "dialog_id": i,
             "context": context,
             "response": response,
             "overall_score": overall_score,
             "prompt": prompt,
             "evaluation": {
-                "Overall": overall,
+                "Overall": None,
             },
             "level": "turn-level"
-        })
+        }
+        if window_info:
+            result["context_window"] = window_info
+        results.append(result)
 
-    with open(output_path, "w") as f:
-        json.dump(results, f, indent=4)
+    results = run_evaluations(g_eval, results, output_path, resume, **run_options)
     print(f"Risultati DSTC salvati in {output_path}")
 
     return results
\ No newline at end of file
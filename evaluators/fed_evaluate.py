@@ -1,19 +1,38 @@
-import json
-from g_eval import GEvalAPI
-import time
+from g_eval import PromptTemplate
+from evaluators.common import run_evaluations, resolve_dimensions, build_multi_template, mean_score
+from evaluators.context_window import window_turns
 
-def process_fed_data(file_path, g_eval, single_template_path, full_template_path, output_path):
+TURN_DIMENSIONS = ["Interesting", "Engaging", "Specific", "Relevant", "Correct", "Semantically appropriate",
+                   "Understandable", "Fluent", "Overall"]
+DIALOG_DIMENSIONS = ["Coherent", "Error recovery", "Consistent", "Diverse", "Depth", "Likeable", "Understanding",
+                     "Flexible", "Informative", "Inquisitive", "Overall"]
+
+def process_fed_data(items, g_eval, single_template_path, full_template_path, output_path, resume=False,
+                     dimensions=None, context_window=None, **run_options):
     single_template = g_eval.load_prompt_template(single_template_path)
     full_template = g_eval.load_prompt_template(full_template_path)
 
-    with open(file_path, "r") as f:
-        data = json.load(f)
+    # Con più dimensioni una sola richiesta restituisce tutti i punteggi del livello
+    known = TURN_DIMENSIONS + [dimension for dimension in DIALOG_DIMENSIONS if dimension not in TURN_DIMENSIONS]
+    turn_dimensions = resolve_dimensions(dimensions, TURN_DIMENSIONS, known)
+    dialog_dimensions = resolve_dimensions(dimensions, DIALOG_DIMENSIONS, known)
+    if dimensions:
+        single_template = build_multi_template(single_template, turn_dimensions)
+        full_template = build_multi_template(full_template, dialog_dimensions)
+
+    # Istruzioni nel prefisso statico (system), dialogo e risposta nel messaggio user
+    single_template = PromptTemplate(single_template)
+    full_template = PromptTemplate(full_template)
 
     results = []
 
-    for instance in data:
+    for dialog_id, instance in items:
         context = instance["context"]
         response = instance.get("response", "").strip()
+        # Nessuna dimensione richiesta per il livello di questo item: niente prompt né richiesta
+        level_dimensions = turn_dimensions if response else dialog_dimensions
+        if not level_dimensions:
+            continue
         annotations = instance.get("annotations", {})
         system = instance.get("system", "")
 
@@ -23,37 +42,34 @@ def process_fed_data(file_path, g_eval, single_template_path, full_template_path
         conversation = context.split("\n")
         conversation = [line.replace("User: ", "").replace("System: ", "").strip() for line in conversation]
 
+        # Il contesto completo resta nel risultato; nel prompt va solo quello della finestra
+        window, window_info = window_turns(context_window, conversation)
         if response:
             full_conversation = " ".join(conversation) + " " + response.replace("System: ", "").strip()
-            prompt = g_eval.generate_prompt(single_template, full_conversation, response.replace("System: ", "").strip())
+            prompt = g_eval.generate_prompt(single_template, " ".join(window) + " " + response.replace("System: ", "").strip(),
+                                            response.replace("System: ", "").strip())
         else:
             full_conversation = " ".join(conversation)
-            prompt = g_eval.generate_prompt(full_template, full_conversation, "")
-
-        evaluations = g_eval.send_request(prompt)
-
-        overall = None
-        for evaluation in evaluations:
-            if "Overall" in evaluation and ":" in evaluation:
-                try:
-                    overall = int(evaluation.split(":")[1].strip())
-                except ValueError:
-                    print(f"Errore nel parsing di Overall: {evaluation}")
-        
-        results.append({
+            prompt = g_eval.generate_prompt(full_template, " ".join(window), "")
+
+        result = {
+            "dialog_id": dialog_id,
             "context": full_conversation,
             "response": response if response else None,
             "system": system,
             "overall_score": overall_score,
             "prompt": prompt,
-            "evaluation": {
-                "Overall": overall,
-            },
+            "evaluation": {dimension: None for dimension in level_dimensions},
             "level": "turn-level" if response else "dialog-level"
-        })
+        }
+        if dimensions:
+            result["human_scores"] = {dimension: mean_score(annotations.get(dimension, []))
+                                      for dimension in level_dimensions}
+        if window_info:
+            result["context_window"] = window_info
+        results.append(result)
 
-    with open(output_path, "w") as f:
-        json.dump(results, f, indent=4)
+    results = run_evaluations(g_eval, results, output_path, resume, **run_options)
     print(f"Risultati salvati in {output_path}")
 
     return results
\ No newline at end of file
@@ -1,40 +1,317 @@
-import openai
+import asyncio
+import re
 import time
+from client_pool import ClientPool, Endpoint
+from metrics import RunMetrics
+from retry import FATAL, RATE_LIMIT, TokenBucket, classify_error, retry_delay
+
+
+class PromptTemplate:
+    """
+    Template compilato una sola volta in un prefisso statico e un suffisso variabile.
+
+    Il prefisso (istruzioni, criteri, passi e formato di risposta) viene inviato come messaggio `system`,
+    identico per tutte le richieste dello stesso template; il suffisso (la sezione con dialogo e risposta)
+    come messaggio `user`. In questo modo il prompt caching del provider può riutilizzare il prefisso comune.
+    """
+
+    PLACEHOLDER = re.compile(r"\{\{(context|response|fact)\}\}")
+
+    def __init__(self, template):
+        lines = template.split("\n")
+        variable = [i for i, line in enumerate(lines) if self.PLACEHOLDER.search(line)]
+        if not variable:
+            self.prefix, self.suffix = template.strip(), ""
+            return
+
+        start, end = variable[0], variable[-1]
+        # L'intestazione della sezione variabile (es. "Dialog:") fa parte del suffisso
+        header = start - 1
+        while header >= 0 and not lines[header].strip():
+            header -= 1
+        if header >= 0 and lines[header].rstrip().endswith(":"):
+            start = header
+
+        before = "\n".join(lines[:start]).rstrip()
+        after = "\n".join(lines[end + 1:]).strip()
+        self.prefix = f"{before}\n\n{after}" if after else before
+        self.suffix = "\n".join(lines[start:end + 1]).strip()
+
+    def render(self, context, response, fact=None):
+        user_content = self.suffix.replace("{{context}}", context).replace("{{response}}", response)
+        # Senza fatto (es. servizio di valutazione) la sezione resta vuota invece di mostrare il segnaposto
+        user_content = user_content.replace("{{fact}}", fact or "")
+        return [{"role": "system", "content": self.prefix}, {"role": "user", "content": user_content}]
+
+
+DEFAULT_BASE_URL = "https://api.gpt4-all.xyz/v1"
+
 
 class GEvalAPI:
-    def __init__(self, api_key, model="gpt-4"):
-        self.client = openai.OpenAI(api_key=api_key, base_url="https://api.gpt4-all.xyz/v1")
+    def __init__(self, api_key, model="gpt-4", max_concurrency=8, requests_per_minute=None, cache=None,
+                 base_url=DEFAULT_BASE_URL, max_retries=6, backoff_base=1.0, backoff_max=60.0, endpoints=None):
+        """
+        Con `endpoints` (lista di `client_pool.Endpoint`) le richieste vengono distribuite tra più endpoint
+        o API key, ciascuno con i propri limiti; altrimenti si usa il solo endpoint `base_url` con `api_key`.
+        """
+        self.pool = ClientPool(endpoints or [Endpoint(base_url, api_key, max_concurrency=max_concurrency)])
+        self.api_key = self.pool.endpoints[0].api_key
+        self.base_url = self.pool.endpoints[0].base_url
+        self.client = self.pool.client(self.pool.endpoints[0])
         self.model = model
+        self.max_concurrency = self.pool.max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.cache = cache
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.usage = {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        self.metrics = RunMetrics()
+        # Coppie (endpoint, modello) che hanno risposto senza logprob: le richieste con fallback passano ai campioni
+        self._no_logprobs = set()
 
     def load_prompt_template(self, file_path):
         with open(file_path, "r") as f:
             return f.read()
 
     def generate_prompt(self, template, context, response,fact = None):
+        if isinstance(template, PromptTemplate):
+            return template.render(context, response, fact)
         to_return = template.replace("{{context}}", context).replace("{{response}}", response)
         if fact:
             to_return = to_return.replace("{{fact}}", fact)
         return to_return
-        
-    def send_request(self, prompt, n=1, max_tokens=50, temperature=0):
+
+    def request_kwargs(self, prompt, n, max_tokens, temperature, top_logprobs=None, response_format=None):
+        """Parametri della chat completion di `prompt` (stringa, inviata come messaggio system, o lista di messaggi)."""
+        request_kwargs = dict(
+            model=self.model,
+            messages=prompt if isinstance(prompt, list) else [{"role": "system", "content": prompt}],
+            n=n,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=1,
+            frequency_penalty=0,
+            presence_penalty=0,
+        )
+        if top_logprobs:
+            request_kwargs.update(logprobs=True, top_logprobs=top_logprobs)
+        if response_format:
+            request_kwargs["response_format"] = response_format
+        return request_kwargs
+
+    def _extract_choices(self, response, top_logprobs=None):
+        """
+        Estrae il testo delle risposte. Se sono richiesti i logprob, ogni risposta diventa un dizionario
+        {"content": testo, "logprobs": [[token, [[alternativa, logprob], ...]], ...]} (logprobs è None
+        se l'endpoint non li restituisce).
+        """
+        if not top_logprobs:
+            return [choice.message.content for choice in response.choices]
+        choices = []
+        for choice in response.choices:
+            tokens = None
+            if choice.logprobs and choice.logprobs.content:
+                tokens = [
+                    [entry.token, [[alternative.token, alternative.logprob] for alternative in entry.top_logprobs]]
+                    for entry in choice.logprobs.content
+                ]
+            choices.append({"content": choice.message.content, "logprobs": tokens})
+        return choices
+
+    def _record_usage(self, response):
+        """Aggiorna `usage` e restituisce i token (input, input da prompt cache, output) della risposta."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return 0, 0, 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        tokens = (usage.prompt_tokens or 0, (getattr(details, "cached_tokens", None) or 0) if details else 0,
+                  usage.completion_tokens or 0)
+        for field, count in zip(("prompt_tokens", "cached_tokens", "completion_tokens"), tokens):
+            self.usage[field] += count
+        return tokens
+
+    def _endpoint_kwargs(self, request_kwargs, endpoint):
+        return dict(request_kwargs, model=endpoint.model) if endpoint.model else request_kwargs
+
+    def _complete(self, response, top_logprobs, request_kwargs, started, attempt, endpoint):
+        """Registra token e latenza della richiesta riuscita, estrae le risposte e le salva in cache."""
+        prompt_tokens, cached_tokens, completion_tokens = self._record_usage(response)
+        self.metrics.record_request(endpoint.model or self.model, time.perf_counter() - started, prompt_tokens,
+                                    cached_tokens, completion_tokens, retries=attempt, endpoint=endpoint.name)
+        evaluations = self._extract_choices(response, top_logprobs)
+        if top_logprobs and all(choice["logprobs"] is None for choice in evaluations):
+            self._no_logprobs.add((endpoint.name, endpoint.model or self.model))
+        self._cache_store(self._endpoint_kwargs(request_kwargs, endpoint), evaluations)
+        return evaluations
+
+    def fallback_kwargs(self, prompt, fallback, max_tokens=50):
+        """Parametri della richiesta a campioni `fallback` (vedi `asend_request`) per `prompt`."""
+        return self.request_kwargs(prompt, fallback.get("n", 1), fallback.get("max_tokens", max_tokens),
+                                   fallback.get("temperature", 0), None, fallback.get("response_format"))
+
+    def cache_keys(self, request_kwargs):
+        """
+        Coppie (modello, chiave di cache) della richiesta, una per modello del pool: ogni risposta è salvata
+        con il modello dell'endpoint che l'ha prodotta, e la richiesta può essere servita da uno qualsiasi.
+        """
+        models = dict.fromkeys(endpoint.model or self.model for endpoint in self.pool.endpoints)
+        return [(model, self.cache.make_key(dict(request_kwargs, model=model))) for model in models]
+
+    def _cache_lookup(self, request_kwargs):
+        if self.cache is None:
+            return None
+        keys = self.cache_keys(request_kwargs)
+        if len(keys) > 1:
+            # Con più modelli si legge la prima chiave presente, così una richiesta conta un solo hit o miss
+            keys = [(model, key) for model, key in keys if self.cache.contains(key)] or keys
+        model, key = keys[0]
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.metrics.record_request(model, 0.0, cache_hit=True)
+        return cached
+
+    def _cache_store(self, request_kwargs, evaluations):
+        if self.cache is not None:
+            self.cache.put(self.cache.make_key(request_kwargs), evaluations)
+
+    def _retry_delay(self, e, attempt, started, endpoint):
+        """
+        Classifica l'errore e restituisce (tipo, attesa in secondi) prima del prossimo tentativo.
+        Gli errori non ritentabili, o esauriti i tentativi, vengono registrati e rilanciati subito, tranne
+        quelli del solo endpoint (es. API key non valida) quando ne restano altri: l'endpoint viene escluso.
+
+        La richiesta evita l'endpoint per il tempo di attesa, quindi con più endpoint il tentativo successivo
+        parte subito su un altro.
+        """
+        kind = classify_error(e)
+        self.metrics.record_endpoint_error(endpoint.name, kind)
+        if kind == FATAL and attempt < self.max_retries and self.pool.disable(endpoint, e):
+            return kind, 0.0
+        if kind == FATAL or attempt >= self.max_retries:
+            print(f"Errore API: {e}")
+            self.metrics.record_request(endpoint.model or self.model, time.perf_counter() - started, retries=attempt,
+                                        error=e.__class__.__name__, endpoint=endpoint.name)
+            raise e
+        delay = retry_delay(e, kind, attempt, self.backoff_base, self.backoff_max)
+        where = f" su {endpoint.name}" if len(self.pool.endpoints) > 1 else ""
+        if kind == RATE_LIMIT:
+            print(f"Raggiunto limite di richiesta{where}, nuovo tentativo tra {delay:.1f}s...")
+        else:
+            print(f"Errore API temporaneo{where} ({e.__class__.__name__}), nuovo tentativo tra {delay:.1f}s...")
+        return kind, delay
+
+    def send_request(self, prompt, n=1, max_tokens=50, temperature=0, top_logprobs=None, response_format=None):
+        request_kwargs = self.request_kwargs(prompt, n, max_tokens, temperature, top_logprobs, response_format)
+        cached = self._cache_lookup(request_kwargs)
+        if cached is not None:
+            return cached
+
+        started = time.perf_counter()
+        attempt = 0
+        avoid = {}
         while True:
+            endpoint = self.pool.acquire_sync(avoid)
             try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[{"role": "system", "content": prompt}],
-                    n=n,
-                    max_tokens=max_tokens,
-                    temperature=temperature,
-                    top_p=1,
-                    frequency_penalty=0,
-                    presence_penalty=0,
-                )
-                evaluations = [choice.message.content for choice in response.choices]
-                return evaluations
+                response = self.pool.client(endpoint).chat.completions.create(
+                    **self._endpoint_kwargs(request_kwargs, endpoint))
             except Exception as e:
-                print(f"Errore API: {e}")
-                if "limit" in str(e).lower():
-                    print("Raggiunto limite di richiesta, attesa in corso...")
-                    raise
-                else:
-                    raise
+                _, delay = self._retry_delay(e, attempt, started, endpoint)
+                attempt += 1
+                avoid[endpoint] = time.monotonic() + delay
+                continue
+            return self._complete(response, top_logprobs, request_kwargs, started, attempt, endpoint)
+
+    async def asend_request(self, prompt, client=None, n=1, max_tokens=50, temperature=0, bucket=None,
+                            top_logprobs=None, response_format=None, fallback=None):
+        """
+        Versione asincrona di `send_request`: la richiesta viene assegnata all'endpoint meno carico del pool
+        (`client`, se indicato, sostituisce il client asincrono dell'endpoint).
+
+        Il token del `bucket` globale (se presente) viene consumato solo se la risposta non è in cache.
+        Ogni endpoint ha il proprio limite di concorrenza adattivo (AdaptiveLimiter) e il proprio
+        circuit breaker; durante l'attesa tra un tentativo e l'altro lo slot di concorrenza viene rilasciato.
+
+        Con `top_logprobs` e `fallback` (opzioni della richiesta a campioni: n, temperature, max_tokens,
+        response_format), un endpoint che ha già risposto senza logprob riceve direttamente la richiesta a
+        campioni: in quel caso le valutazioni sono stringhe invece che dizionari.
+        """
+        request_kwargs = self.request_kwargs(prompt, n, max_tokens, temperature, top_logprobs, response_format)
+        cached = self._cache_lookup(request_kwargs)
+        if cached is not None:
+            return cached
+        fallback_kwargs = self.fallback_kwargs(prompt, fallback, max_tokens) if top_logprobs and fallback else None
+
+        # La latenza parte dal primo invio: l'attesa di uno slot di concorrenza non è conteggiata
+        started = None
+        attempt = 0
+        avoid = {}
+        while True:
+            endpoint = await self.pool.acquire(avoid)
+            try:
+                async with self.pool.slot(endpoint, bucket) as available:
+                    if not available:
+                        continue
+                    started = started or time.perf_counter()
+                    sent_kwargs, sent_logprobs = request_kwargs, top_logprobs
+                    if fallback_kwargs and (endpoint.name, endpoint.model or self.model) in self._no_logprobs:
+                        # Endpoint che non restituisce logprob: niente richiesta destinata a fallire
+                        cached = self._cache_lookup(fallback_kwargs)
+                        if cached is not None:
+                            return cached
+                        sent_kwargs, sent_logprobs = fallback_kwargs, None
+                    response = await (client or self.pool.async_client(endpoint)).chat.completions.create(
+                        **self._endpoint_kwargs(sent_kwargs, endpoint))
+            except Exception as e:
+                kind, delay = self._retry_delay(e, attempt, started, endpoint)
+                if kind == RATE_LIMIT:
+                    endpoint.limiter.on_rate_limit()
+                elif kind != FATAL:
+                    endpoint.breaker.record(False)
+                attempt += 1
+                avoid[endpoint] = time.monotonic() + delay
+                continue
+            endpoint.breaker.record(True)
+            endpoint.limiter.on_success()
+            return self._complete(response, sent_logprobs, sent_kwargs, started, attempt, endpoint)
+
+    async def _send_many(self, prompts, n, max_tokens, temperature, top_logprobs, on_result, response_format=None,
+                         fallback=None):
+        bucket = TokenBucket(self.requests_per_minute) if self.requests_per_minute else None
+        results = [None] * len(prompts)
+
+        async def worker(index, prompt):
+            results[index] = await self.asend_request(prompt, None, n, max_tokens, temperature, bucket, top_logprobs,
+                                                      response_format, fallback)
+            if on_result:
+                on_result(index, results[index])
+
+        await asyncio.gather(*(worker(i, p) for i, p in enumerate(prompts)))
+        return results
+
+    def send_many(self, prompts, n=1, max_tokens=50, temperature=0, on_result=None, top_logprobs=None,
+                  response_format=None, fallback=None):
+        """
+        Invia più prompt in parallelo rispettando `max_concurrency` e `requests_per_minute`.
+        In caso di 429 la concorrenza effettiva dell'endpoint scende e risale gradualmente con i successi.
+
+        Args:
+            prompts (list): Prompt da inviare (stringhe o liste di messaggi prodotte da `PromptTemplate`).
+            on_result (callable, opzionale): Chiamata con `(indice, evaluations)` al termine di ogni richiesta.
+            top_logprobs (int, opzionale): Se indicato, richiede i logprob dei token più probabili
+                (vedi `_extract_choices` per il formato delle risposte).
+            response_format (dict, opzionale): Formato strutturato della risposta, es. {"type": "json_object"}.
+            fallback (dict, opzionale): Opzioni della richiesta a campioni per gli endpoint senza logprob
+                (vedi `asend_request`).
+
+        Returns:
+            list[list[str]]: Le valutazioni di ciascun prompt, nello stesso ordine dell'input.
+        """
+        if not prompts:
+            return []
+        return self.pool.run(self._send_many(list(prompts), n, max_tokens, temperature, top_logprobs, on_result,
+                                             response_format, fallback))
+
+    def close(self):
+        """Chiude i client HTTP del pool e il suo event loop."""
+        self.pool.close()
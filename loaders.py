@@ -0,0 +1,188 @@
+import hashlib
+import json
+import random
+
+_WHITESPACE = " \t\n\r"
+
+
+class _JsonStream:
+    """Lettura bufferizzata di un file JSON, decodificato un valore alla volta."""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = f.read(chunk_size)
+        self.eof = len(self.buffer) < chunk_size
+        self.pos = 0
+
+    def _fill(self, read_size):
+        chunk = self.f.read(read_size)
+        self.eof = len(chunk) < read_size
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self, skip=""):
+        """Primo carattere significativo, saltando spazi e i caratteri in `skip` (None a fine file)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE + skip:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return None
+            self._fill(self.chunk_size)
+
+    def advance(self):
+        self.pos += 1
+
+    def decode(self):
+        """Decodifica il valore successivo, leggendo altri dati se non è contenuto nel buffer."""
+        read_size = self.chunk_size
+        while True:
+            try:
+                if self.pos >= len(self.buffer):
+                    raise json.JSONDecodeError("buffer vuoto", self.buffer, self.pos)
+                item, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if not self.eof and (end == len(self.buffer) or self.buffer[end] not in _WHITESPACE + ",:]}"):
+                    # L'elemento potrebbe proseguire nel prossimo blocco (es. un numero troncato come "4.")
+                    raise json.JSONDecodeError("elemento incompleto", self.buffer, end)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                # Elemento più grande del buffer: leggi altri dati (a blocchi crescenti)
+                self._fill(read_size)
+                read_size *= 2
+                continue
+            self.pos = end
+            return item
+
+    def iter_array(self):
+        """Elementi dell'array che inizia alla posizione corrente."""
+        self.advance()
+        while True:
+            if self.peek(",") == "]":
+                self.advance()
+                return
+            yield self.decode()
+
+
+def iter_json_array(file_path, chunk_size=1 << 16, key=None):
+    """
+    Legge un file contenente un array JSON e restituisce gli elementi uno alla volta,
+    senza caricare l'intero file in memoria.
+
+    Con `key` il file è invece un oggetto JSON e vengono restituiti gli elementi dell'array `key`
+    (es. una colonna di DSTC9); gli altri membri vengono letti e scartati un elemento alla volta.
+    """
+    with open(file_path, "r") as f:
+        stream = _JsonStream(f, chunk_size)
+        if key is None:
+            if stream.peek() != "[":
+                raise ValueError(f"{file_path} non contiene un array JSON.")
+            yield from stream.iter_array()
+            return
+
+        if stream.peek() != "{":
+            raise ValueError(f"{file_path} non contiene un oggetto JSON.")
+        stream.advance()
+        while stream.peek(",") not in ("}", None):
+            name = stream.decode()
+            if stream.peek() != ":":
+                raise ValueError(f"{file_path}: ':' mancante dopo la chiave {name!r}.")
+            stream.advance()
+            if name == key:
+                if stream.peek() != "[":
+                    raise ValueError(f"{file_path}: il membro {key!r} non è un array JSON.")
+                yield from stream.iter_array()
+                return
+            if stream.peek() == "[":
+                for _ in stream.iter_array():
+                    pass
+            else:
+                stream.decode()
+        raise ValueError(f"{file_path}: chiave {key!r} non trovata.")
+
+
+def iter_records(file_path):
+    """Adapter per i dataset a lista di record (FED, TC_USR, PC_USR, ConvAI2): produce coppie (indice, record)."""
+    return enumerate(iter_json_array(file_path))
+
+
+def iter_dstc_records(file_path):
+    """
+    Adapter per il formato colonnare di DSTC9 (`contexts`/`responses`/`scores`):
+    produce coppie (indice, {"context", "response", "score"}).
+    """
+    # Ogni colonna viene letta in streaming con un proprio passaggio sul file: in memoria resta un record alla volta
+    columns = [iter_json_array(file_path, key=key) for key in ("contexts", "responses", "scores")]
+    for i, (context, response, score) in enumerate(zip(*columns)):
+        yield i, {"context": context, "response": response, "score": score}
+
+
+LOADERS = {
+    "fed": iter_records,
+    "tc_usr": iter_records,
+    "pc_usr": iter_records,
+    "convai": iter_records,
+    "dstc": iter_dstc_records,
+}
+
+
+def reservoir_sample(items, k, seed=None):
+    """
+    Campiona k elementi da un iterabile in un'unica passata (Algorithm R).
+    Gli elementi scelti vengono restituiti nell'ordine originale.
+    """
+    rng = random.Random(seed)
+    reservoir = []
+    for n, item in enumerate(items):
+        if n < k:
+            reservoir.append((n, item))
+        else:
+            j = rng.randint(0, n)
+            if j < k:
+                reservoir[j] = (n, item)
+    reservoir.sort(key=lambda entry: entry[0])
+    return [item for _, item in reservoir]
+
+
+def shard_of(record, num_shards):
+    """
+    Shard a cui appartiene un record: hash SHA-1 del suo contenuto modulo `num_shards`.
+    Dipende solo dal record, quindi è lo stesso su ogni processo o macchina.
+    """
+    payload = json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return int.from_bytes(hashlib.sha1(payload).digest()[:8], "big") % num_shards
+
+
+def shard_items(items, shard_index, num_shards):
+    """Filtra le coppie (indice, record) che appartengono allo shard `shard_index` di `num_shards`."""
+    return ((i, record) for i, record in items if shard_of(record, num_shards) == shard_index)
+
+
+def load_dataset(mode, file_path, num_records=None, seed=None, shard_index=None, num_shards=1):
+    """
+    Restituisce le coppie (indice, record) del dataset per la modalità indicata.
+
+    Args:
+        mode (str): Formato del dataset (fed, tc_usr, pc_usr, dstc, convai).
+        file_path (str): Percorso del file JSON del dataset.
+        num_records (int): Se indicato, campiona questo numero di record con reservoir sampling.
+        seed (int): Seed per il campionamento.
+        shard_index (int): Se indicato, restituisce solo i record di questo shard (vedi `shard_of`).
+            Il campionamento avviene prima della suddivisione, quindi con lo stesso seed gli shard
+            partizionano lo stesso campione.
+        num_shards (int): Numero totale di shard.
+
+    Returns:
+        Iterabile di coppie (indice, record); è un generatore lazy se non si campiona.
+    """
+    if mode not in LOADERS:
+        raise ValueError(f"Formato di dataset non supportato: {mode}")
+    items = LOADERS[mode](file_path)
+    if num_records:
+        items = reservoir_sample(items, num_records, seed)
+    if shard_index is not None and num_shards > 1:
+        items = shard_items(items, shard_index, num_shards)
+    return items
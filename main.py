@@ -1,18 +1,17 @@
-import json
-import random
 import argparse
 import os
 from dotenv import load_dotenv
-from g_eval import GEvalAPI
-from evaluators.fed_evaluate import process_fed_data
-from evaluators.tc_usr_evaluate import process_tc_usr_data
-from evaluators.pc_usr_evaluate import process_pc_usr_data
-from evaluators.dstc_evaluate import process_dstc_data
-from evaluators.convai_evaluate import process_convai_data
-from scipy.stats import pearsonr, spearmanr, kendalltau
-import pandas as pd
+from cache import ResponseCache
+from evaluators.context_window import ContextWindow
+from loaders import load_dataset
+from planning import DryRun
+from shards import launch_shards, merge_shards, shard_output_path, shard_paths
+
+# openai, pandas, scipy e matplotlib vengono importati solo nelle modalità che li usano
 
 def plot_distance_bars(results, output_folder):
+    import matplotlib
+    matplotlib.use("Agg")
     import matplotlib.pyplot as plt
 
     metrics = ["Pearson", "Spearman", "Kendall-Tau"]
@@ -51,107 +50,481 @@ def plot_distance_distribution(df, output_folder):
     plt.savefig(os.path.join(output_folder, "distance_bar_plot.png"))
     plt.close()
 
-def load_config():
-    """Carica la API key dall'ambiente"""
+def load_config(shard_index=None):
+    """
+    Carica la API key dall'ambiente. Se OPENAI_API_KEYS contiene più chiavi separate da virgola,
+    ogni shard usa la propria (assegnate a rotazione).
+    """
     load_dotenv()
-    api_key = os.getenv("OPENAI_API_KEY")
+    api_keys = [key.strip() for key in os.getenv("OPENAI_API_KEYS", "").split(",") if key.strip()]
+    api_key = api_keys[(shard_index or 0) % len(api_keys)] if api_keys else os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise ValueError("API key non trovata. Assicurati che OPENAI_API_KEY sia configurata.")
     return api_key
 
 
-def sample_data(file_path, num_records=None):
-    """Carica e campiona i dati dal file JSON."""
-    with open(file_path, "r") as f:
-        data = json.load(f)
-    return random.sample(data, min(num_records, len(data))) if num_records else data
+def load_endpoints_config(base_url, max_concurrency, shard_index=None, endpoints_file=None, placeholder_key=None):
+    """
+    Endpoint del pool di client: quelli del file JSON `endpoints_file` (o OPENAI_ENDPOINTS_FILE) se indicato;
+    altrimenti, senza sharding, uno per ogni chiave di OPENAI_API_KEYS. Con una sola chiave (o con lo
+    sharding, dove ogni shard usa la propria) restituisce None e si usa il solo endpoint di `load_config`.
+    `placeholder_key` sostituisce le chiavi mancanti del file (vedi `client_pool.load_endpoints`).
+    """
+    from client_pool import Endpoint, load_endpoints
 
-def calculate_correlations(data):
+    load_dotenv()
+    endpoints_file = endpoints_file or os.getenv("OPENAI_ENDPOINTS_FILE")
+    if endpoints_file:
+        return load_endpoints(endpoints_file, base_url, max_concurrency, placeholder_key)
+    api_keys = [key.strip() for key in os.getenv("OPENAI_API_KEYS", "").split(",") if key.strip()]
+    if shard_index is None and len(api_keys) > 1:
+        return [Endpoint(base_url, api_key, max_concurrency=max_concurrency) for api_key in api_keys]
+    return None
+
+
+def create_client(base_url=None, max_concurrency=8, requests_per_minute=None, cache=None, max_retries=6,
+                  shard_index=None, endpoints_file=None, model="gpt-4o-mini", dry_run=False):
     """
-    Calcola le correlazioni tra overall_score e evaluation["Overall"].
+    Crea il client `GEvalAPI` con l'endpoint (o il pool di endpoint) e l'API key configurati.
+    Con `dry_run` le chiavi mancanti non sono un errore: il client serve solo a pianificare e non invia richieste.
     """
-    human_scores = []
-    model_scores = []
+    from g_eval import GEvalAPI, DEFAULT_BASE_URL
 
-    for entry in data:
-          human_score = entry.get("overall_score")
-          model_score = entry.get("evaluation", {}).get("Overall")
+    load_dotenv()
+    base_url = base_url or os.getenv("OPENAI_BASE_URL", DEFAULT_BASE_URL)
+    placeholder_key = DRY_RUN_API_KEY if dry_run else None
+    endpoints = load_endpoints_config(base_url, max_concurrency, shard_index, endpoints_file, placeholder_key)
+    api_key = None
+    if endpoints is None:
+        api_key = placeholder_key if dry_run else load_config(shard_index)
+    return GEvalAPI(api_key=api_key, model=model, max_concurrency=max_concurrency,
+                    requests_per_minute=requests_per_minute, cache=cache, base_url=base_url,
+                    max_retries=max_retries, endpoints=endpoints)
 
-          if human_score is not None and model_score is not None:
-              human_scores.append(human_score)
-              model_scores.append(model_score)
 
-    # Calcolo delle correlazioni
-    pearson_corr, _ = pearsonr(human_scores, model_scores)
-    spearman_corr, _ = spearmanr(human_scores, model_scores)
-    kendall_corr, _ = kendalltau(human_scores, model_scores)
+EVALUATION_MODES = ("fed", "tc_usr", "pc_usr", "dstc", "convai")
+# Chiave fittizia del client con --dry_run, che si ferma al piano senza inviare richieste
+DRY_RUN_API_KEY = "dry-run"
 
-    return pearson_corr, spearman_corr, kendall_corr
 
+def run_evaluation(mode, data, g_eval, single_template_path, full_template_path, output_file, resume=False,
+                   dimensions=None, batch_options=None, context_window=None, **run_options):
+    """
+    Valuta i record di un dataset con l'evaluator della modalità indicata.
 
-def main(mode, input_file, single_template_path, full_template_path, output_file, num_records):
+    Args:
+        mode (str): Modalità di valutazione (fed, tc_usr, pc_usr, dstc, convai).
+        data (iterable): Coppie (indice, record) prodotte da `load_dataset`.
+        batch_options (dict): Opzioni della modalità batch (solo tc_usr e pc_usr).
+        context_window (ContextWindow): Finestra applicata al contesto dei dialoghi nei prompt (opzionale).
+        run_options: Opzioni inoltrate a `run_evaluations` (es. scoring, num_samples).
+
+    Returns:
+        list[dict]: I risultati della valutazione.
+    """
+    batch_options = batch_options or {}
+    if mode == "fed":
+        from evaluators.fed_evaluate import process_fed_data
+        return process_fed_data(data, g_eval, single_template_path, full_template_path, output_file, resume,
+                                dimensions, context_window=context_window, **run_options)
+    elif mode == "tc_usr":
+        from evaluators.tc_usr_evaluate import process_tc_usr_data
+        return process_tc_usr_data(data, g_eval, single_template_path, output_file, resume, dimensions,
+                                   context_window=context_window, **batch_options, **run_options)
+    elif mode == "pc_usr":
+        from evaluators.pc_usr_evaluate import process_pc_usr_data
+        return process_pc_usr_data(data, g_eval, single_template_path, output_file, resume, dimensions,
+                                   context_window=context_window, **batch_options, **run_options)
+    elif mode == "dstc":
+        from evaluators.dstc_evaluate import process_dstc_data
+        return process_dstc_data(data, g_eval, full_template_path, output_file, resume, context_window,
+                                 **run_options)
+    elif mode == "convai":
+        from evaluators.convai_evaluate import process_convai_data
+        return process_convai_data(data, g_eval, full_template_path, output_file, resume, context_window,
+                                   **run_options)
+    raise ValueError(f"Modalità di valutazione non valida: {mode}")
+
+
+def main(mode, input_file, single_template_path, full_template_path, output_file, num_records,
+         max_concurrency=8, requests_per_minute=None, use_cache=True, refresh_cache=False,
+         cache_path="results/cache.sqlite", resume=False, seed=None, dimensions=None, scoring="single",
+         num_samples=20, batch_size=0, batch_template_path="prompts/usr_batch_responses.txt", group_by=None,
+         bootstrap=0, compare_file=None, base_url=None, max_retries=6,
+         metrics_file=None, shard_index=None, num_shards=1, shard_processes=None, dry_run=False,
+         keep_prompts=False, context_max_tokens=None, context_last_turns=None, report_processes=None,
+         force_report=False, adaptive_ci_width=None, adaptive_batch_size=50, adaptive_max_records=None,
+         adaptive_max_cost=None, endpoints_file=None, output_format="text", max_reasks=1, host="127.0.0.1",
+         port=8080, serve_max_batch_size=16, serve_max_wait_ms=5, serve_max_pending=256):
     """
     Esegue l'elaborazione del dataset in base alla modalità selezionata.
 
     Args:
-        mode (str): Modalità di esecuzione (fed, tc_usr, pc_usr, dstc, convai).
+        mode (str): Modalità di esecuzione (fed, tc_usr, pc_usr, dstc, convai, result, merge, report, serve).
         input_file (str): Percorso al file JSON del dataset.
         single_template_path (str): Percorso al template per risposte singole.
         full_template_path (str): Percorso al template per dialoghi completi (solo per 'fed').
         output_file (str): Percorso per salvare i risultati.
         num_records (int): Numero di record da elaborare.
+        max_concurrency (int): Numero massimo di richieste API contemporanee.
+        requests_per_minute (int): Limite di richieste al minuto (nessun limite se None).
+        use_cache (bool): Se True riutilizza le risposte salvate nella cache su disco.
+        refresh_cache (bool): Se True ignora le voci in cache e le sovrascrive con nuove risposte.
+        cache_path (str): Percorso del database SQLite della cache.
+        resume (bool): Se True riprende un'esecuzione interrotta dal checkpoint `<output_file>.jsonl`.
+        seed (int): Seed per il campionamento dei record (necessario per riprendere sullo stesso campione).
+        dimensions (list[str]): Dimensioni da valutare con un'unica richiesta (fed, tc_usr, pc_usr);
+            ["all"] per tutte quelle annotate, None per il solo Overall.
+        scoring (str): Calcolo del punteggio: "single" (punteggio discreto), "logprobs" (atteso, pesato con le
+            probabilità dei token) o "samples" (medio su `num_samples` risposte di una sola richiesta).
+        num_samples (int): Numero di risposte per richiesta in modalità "samples".
+        batch_size (int): Se > 0 (solo tc_usr e pc_usr), valuta fino a batch_size risposte dello stesso contesto
+            con una sola richiesta; 0 disabilita la modalità batch.
+        batch_template_path (str): Percorso del template per la modalità batch.
+        group_by (list[str]): In modalità result, campi per cui raggruppare le correlazioni (es. system, level).
+        bootstrap (int): In modalità result, numero di ricampionamenti per gli intervalli di confidenza.
+        compare_file (str): In modalità result, secondo file di risultati da confrontare con un test di permutazione.
+        base_url (str): URL base dell'endpoint compatibile con le API OpenAI (default: OPENAI_BASE_URL o
+            l'endpoint predefinito).
+        max_retries (int): Tentativi massimi per rate limit ed errori temporanei (timeout, 5xx) prima di
+            interrompere l'esecuzione; gli errori non ritentabili interrompono subito.
+        metrics_file (str): Se indicato, salva le metriche per richiesta in questo file (JSONL, oppure formato
+            Prometheus se termina con ".prom").
+        shard_index (int): Valuta solo lo shard indicato (da 0) e salva i risultati in
+            `<output_file>.shard-<i>-of-<N>.json`.
+        num_shards (int): Numero di shard in cui suddividere il dataset. Per eseguire tutti gli shard in parallelo
+            su questa macchina e unirli in `output_file` si usa `run_sharded`.
+        shard_processes (int): Processi usati da `run_sharded` per eseguire gli shard (default: uno per shard).
+        dry_run (bool): Se True stampa il piano di esecuzione (prompt unici, token, costo e tempo stimati)
+            senza inviare richieste né scrivere risultati.
+        keep_prompts (bool): Salva anche i prompt nei formati compatti (output .jsonl.gz o .parquet).
+        context_max_tokens (int): Budget di token del contesto dei dialoghi nei prompt; i turni centrali
+            vengono sostituiti da "[...]" (il primo turno e gli ultimi vengono conservati).
+        context_last_turns (int): Conserva nel prompt solo il primo turno e gli ultimi K turni del contesto.
+        report_processes (int): In modalità report, processi usati per generare grafici e tabelle
+            (default: uno per CPU).
+        force_report (bool): In modalità report, rigenera anche gli output il cui file di risultati non è cambiato.
+        adaptive_ci_width (float): Se indicato, valutazione adattiva: l'intero dataset viene valutato a blocchi
+            casuali (riproducibili con `seed`) fermandosi quando l'ampiezza degli intervalli di confidenza
+            delle correlazioni scende sotto questo valore; `num_records` viene ignorato.
+        adaptive_batch_size (int): Record per blocco nella valutazione adattiva.
+        adaptive_max_records (int): Numero massimo di record nella valutazione adattiva.
+        adaptive_max_cost (float): Costo massimo stimato in USD nella valutazione adattiva.
+        endpoints_file (str): File JSON con gli endpoint/API key tra cui distribuire le richieste (pesi, limiti
+            di concorrenza e di richieste al minuto per endpoint); default OPENAI_ENDPOINTS_FILE.
+        output_format (str): Formato delle risposte: "text" (formato del template) o "json" (oggetto JSON con
+            max_tokens ridotto; non disponibile in modalità batch).
+        max_reasks (int): Nuove richieste al massimo per le risposte in cui mancano dei punteggi (0 le disabilita).
+        host (str): In modalità serve, indirizzo di ascolto del servizio HTTP.
+        port (int): In modalità serve, porta del servizio HTTP.
+        serve_max_batch_size (int): In modalità serve, valutazioni massime per micro-batch.
+        serve_max_wait_ms (float): In modalità serve, attesa massima (ms) per completare un micro-batch.
+        serve_max_pending (int): In modalità serve, valutazioni accodate o in corso oltre le quali le nuove
+            richieste ricevono 503.
     """
-    api_key = load_config()
-    model = "gpt-4o-mini"
-    g_eval = GEvalAPI(api_key=api_key, model=model)
+    if mode == "report":
+        from report import report_folders, run_report
 
-    data = sample_data(input_file, num_records)
-    temp_file = "results/temp_test_data.json"
+        written = run_report(report_folders(input_file), report_processes, force_report)
+        print(f"Report completato: {len(written)} file generati.")
+        return
 
-    # Salva i dati campionati temporaneamente
-    with open(temp_file, "w") as f:
-        json.dump(data, f, indent=4)
+    if mode == "serve":
+        from server import ScoringService, serve
 
-    if mode == "fed":
-        results = process_fed_data(temp_file, g_eval, single_template_path, full_template_path, output_file)
-    elif mode == "tc_usr":
-        results = process_tc_usr_data(temp_file, g_eval, single_template_path, output_file)
-    elif mode == "pc_usr":
-        results = process_pc_usr_data(temp_file, g_eval, single_template_path, output_file)
-    elif mode == "dstc":
-        results = process_dstc_data(temp_file, g_eval, full_template_path, output_file)
-    elif mode == "convai":
-        results = process_convai_data(temp_file, g_eval, full_template_path, output_file)
+        if not single_template_path:
+            raise ValueError("La modalità serve richiede --single_template_path.")
+        model = "gpt-4o-mini"
+        cache = ResponseCache(cache_path, refresh=refresh_cache) if use_cache else None
+        g_eval = create_client(base_url, max_concurrency, requests_per_minute, cache, max_retries,
+                               endpoints_file=endpoints_file, model=model)
+        context_window = None
+        if context_max_tokens is not None or context_last_turns is not None:
+            context_window = ContextWindow(context_max_tokens, context_last_turns, model=model)
+        service = ScoringService(g_eval, single_template_path, dimensions, scoring, num_samples, output_format,
+                                 max_reasks, batch_template_path if batch_size else None, context_window,
+                                 serve_max_batch_size, serve_max_wait_ms, serve_max_pending)
+        try:
+            serve(service, host, port)
+        finally:
+            if cache is not None:
+                cache.close()
+        return
+
+    if shard_index is not None and not 0 <= shard_index < num_shards:
+        raise ValueError(f"shard_index deve essere compreso tra 0 e {num_shards - 1}.")
+    if adaptive_ci_width is not None and num_shards > 1:
+        raise ValueError("La valutazione adattiva non supporta lo sharding.")
+    if mode in EVALUATION_MODES and (num_shards > 1 and num_records or adaptive_ci_width is not None) and seed is None:
+        # Tutti gli shard devono suddividere lo stesso campione; i blocchi adattivi devono essere riproducibili
+        seed = 0
+
+    if mode in EVALUATION_MODES and num_shards > 1 and shard_index is None:
+        raise ValueError("Senza shard_index gli shard vanno eseguiti con run_sharded.")
+    if mode == "merge":
+        merge_shards(shard_paths(input_file), output_file)
+        mode, input_file = "result", output_file
+    elif shard_index is not None:
+        output_file = shard_output_path(output_file, shard_index, num_shards)
+
+    cache = None
+    if mode in EVALUATION_MODES:
+        model = "gpt-4o-mini"
+        if use_cache and dry_run:
+            # Il piano legge soltanto la cache esistente, senza crearla né modificarla
+            if os.path.exists(cache_path):
+                cache = ResponseCache(cache_path, refresh=refresh_cache, read_only=True)
+        elif use_cache:
+            cache = ResponseCache(cache_path, refresh=refresh_cache)
+        g_eval = create_client(base_url, max_concurrency, requests_per_minute, cache, max_retries, shard_index,
+                               endpoints_file, model, dry_run)
+
+        # I record vengono letti in streaming e campionati in un'unica passata (la valutazione adattiva
+        # campiona invece a blocchi dall'intero dataset)
+        sample_size = num_records if adaptive_ci_width is None else None
+        data = load_dataset(mode, input_file, sample_size, seed, shard_index, num_shards)
+        run_options = dict(scoring=scoring, num_samples=num_samples, dry_run=dry_run, keep_prompts=keep_prompts,
+                           output_format=output_format, max_reasks=max_reasks)
+        batch_options = dict(batch_template_path=batch_template_path, batch_size=batch_size)
+        context_window = None
+        if context_max_tokens is not None or context_last_turns is not None:
+            context_window = ContextWindow(context_max_tokens, context_last_turns, model=model)
+
+        try:
+            if adaptive_ci_width is not None:
+                from adaptive import run_adaptive
+
+                def evaluate(batch, batch_output):
+                    return run_evaluation(mode, batch, g_eval, single_template_path, full_template_path,
+                                          batch_output, False, dimensions, batch_options, context_window,
+                                          **run_options)
+
+                results = run_adaptive(evaluate, data, output_file, adaptive_ci_width,
+                                       adaptive_batch_size, adaptive_max_records, adaptive_max_cost, g_eval.metrics,
+                                       n_bootstrap=bootstrap or 1000, seed=seed, keep_prompts=keep_prompts)["results"]
+            else:
+                results = run_evaluation(mode, data, g_eval, single_template_path, full_template_path, output_file,
+                                         resume, dimensions, batch_options, context_window, **run_options)
+        except DryRun:
+            print("Dry run: nessuna richiesta inviata.")
+            if cache is not None:
+                cache.close()
+            return
+        finally:
+            g_eval.close()
+        g_eval.metrics.print_report()
+        if metrics_file:
+            g_eval.metrics.write(metrics_file)
+            print(f"Metriche salvate in {metrics_file}")
     elif mode == "result":
-        results = json.load(open(input_file, "r"))
+        from correlations import (analysis_columns, calculate_correlations, calculate_dimension_correlations,
+                                  correlation_table, load_results, permutation_test, score_columns)
+
+        # Dai file Parquet vengono lette solo le colonne usate per l'analisi
+        results = load_results(input_file, columns=analysis_columns(group_by))
+        model_column = score_columns()[1]
+        unscored = int(results[model_column].isna().sum()) if model_column in results else 0
+        if unscored:
+            print(f"Attenzione: {unscored} risultati senza punteggio del modello, esclusi dalle correlazioni")
         correlation_results = calculate_correlations(results)
         print("\nCorrelazioni calcolate:")
         print(f"Pearson: {correlation_results[0]}")
         print(f"Spearman: {correlation_results[1]}")
         print(f"Kendall-Tau: {correlation_results[2]}")
+        dimension_correlations = calculate_dimension_correlations(results)
+        if dimension_correlations:
+            print("\nCorrelazioni per dimensione (Pearson / Spearman / Kendall-Tau):")
+            for dimension, (pearson, spearman, kendall) in dimension_correlations.items():
+                print(f"{dimension}: {pearson:.4f} / {spearman:.4f} / {kendall:.4f}")
+        if group_by or bootstrap:
+            table = correlation_table(results, group_by=group_by, n_bootstrap=bootstrap, seed=seed)
+            print("\nCorrelazioni per gruppo:")
+            print(table.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+        if compare_file:
+            comparison = permutation_test(results, load_results(compare_file, columns=analysis_columns()), seed=seed)
+            print(f"\nConfronto Spearman con {compare_file} su {comparison['n']} elementi comuni:")
+            print(f"{comparison['correlation_a']:.4f} vs {comparison['correlation_b']:.4f} "
+                  f"(differenza {comparison['difference']:.4f}, p-value {comparison['p_value']:.4f})")
         plot_distance_bars(correlation_results, os.path.dirname(output_file))
     else:
-        raise ValueError("Modalità non valida. Usa 'fed', 'tc_usr', 'pc_usr', 'dstc' o 'convai'.")
+        raise ValueError("Modalità non valida. Usa 'fed', 'tc_usr', 'pc_usr', 'dstc', 'convai', 'result', 'merge', "
+                         "'report' o 'serve'.")
+
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Cache: {stats['hits']} hit, {stats['misses']} miss")
+        cache.close()
 
     print(f"Elaborazione completata per la modalità '{mode}'. Risultati salvati in {output_file}")
 
 
+def cli_options(args):
+    """Argomenti di `main` ricavati dalla riga di comando (inoltrati anche ai processi degli shard)."""
+    return {
+        "mode": args.mode,
+        "input_file": args.input_file,
+        "single_template_path": args.single_template_path,
+        "full_template_path": args.full_template_path,
+        "output_file": args.output_file,
+        "num_records": args.num_records,
+        "max_concurrency": args.max_concurrency,
+        "requests_per_minute": args.requests_per_minute,
+        "use_cache": not args.no_cache,
+        "refresh_cache": args.refresh_cache,
+        "cache_path": args.cache_path,
+        "resume": args.resume,
+        "seed": args.seed,
+        "dimensions": args.dimensions,
+        "scoring": args.scoring,
+        "num_samples": args.num_samples,
+        "batch_size": args.batch_size,
+        "batch_template_path": args.batch_template_path,
+        "group_by": args.group_by,
+        "bootstrap": args.bootstrap,
+        "compare_file": args.compare_file,
+        "base_url": args.base_url,
+        "max_retries": args.max_retries,
+        "metrics_file": args.metrics_file,
+        "shard_index": args.shard_index,
+        "num_shards": args.num_shards,
+        "shard_processes": args.shard_processes,
+        "dry_run": args.dry_run,
+        "keep_prompts": args.keep_prompts,
+        "context_max_tokens": args.context_max_tokens,
+        "context_last_turns": args.context_last_turns,
+        "report_processes": args.report_processes,
+        "force_report": args.force_report,
+        "adaptive_ci_width": args.adaptive_ci_width,
+        "adaptive_batch_size": args.adaptive_batch_size,
+        "adaptive_max_records": args.adaptive_max_records,
+        "adaptive_max_cost": args.adaptive_max_cost,
+        "endpoints_file": args.endpoints_file,
+        "output_format": args.output_format,
+        "max_reasks": args.max_reasks,
+        "host": args.host,
+        "port": args.port,
+        "serve_max_batch_size": args.serve_max_batch_size,
+        "serve_max_wait_ms": args.serve_max_wait_ms,
+        "serve_max_pending": args.serve_max_pending,
+    }
+
+
+def run_sharded(options):
+    """
+    Esegue in locale tutti gli shard di una valutazione in processi separati (`options` sono gli argomenti
+    di `main`, vedi `cli_options`), unisce i risultati in `output_file` e ne calcola le correlazioni.
+    """
+    if options["adaptive_ci_width"] is not None:
+        raise ValueError("La valutazione adattiva non supporta lo sharding.")
+    if options["num_records"] and options["seed"] is None:
+        # Tutti gli shard devono suddividere lo stesso campione
+        options = dict(options, seed=0)
+    paths = launch_shards(main, options, options["num_shards"], options["shard_processes"])
+    if options["dry_run"]:
+        return
+    merge_shards(paths, options["output_file"])
+    main(**dict(options, mode="result", input_file=options["output_file"]))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Esegui la demo per i dataset di valutazione.")
-    parser.add_argument("--mode", type=str, required=True, choices=["fed", "tc_usr", "pc_usr", "dstc", "convai", "result"],
-                        help="Modalità: 'fed', 'tc_usr', 'pc_usr', 'dstc', 'convai', 'result'.")
-    parser.add_argument("--input_file", type=str, required=True, help="Percorso al file JSON del dataset.")
+    parser.add_argument("--mode", type=str, required=True, choices=["fed", "tc_usr", "pc_usr", "dstc", "convai", "result", "merge", "report", "serve"],
+                        help="Modalità: 'fed', 'tc_usr', 'pc_usr', 'dstc', 'convai', 'result', 'merge', 'report', 'serve'.")
+    parser.add_argument("--input_file", type=str, default=None,
+                        help="Percorso al file JSON del dataset (in modalità report: cartella dei risultati); "
+                             "non richiesto in modalità serve.")
     parser.add_argument("--single_template_path", type=str, help="Percorso al template per risposte singole.")
     parser.add_argument("--full_template_path", type=str, help="Percorso al template per dialoghi completi (solo per 'fed').")
-    parser.add_argument("--output_file", type=str, required=True, help="Percorso per salvare i risultati.")
+    parser.add_argument("--output_file", type=str, default=None,
+                        help="Percorso per salvare i risultati (.json, oppure .jsonl.gz / .parquet compatti); "
+                             "non richiesto in modalità report e serve.")
     parser.add_argument("--num_records", type=int, default=2, help="Numero di record da elaborare (opzionale).")
+    parser.add_argument("--max_concurrency", type=int, default=8, help="Numero massimo di richieste API contemporanee.")
+    parser.add_argument("--requests_per_minute", type=int, default=None,
+                        help="Limite di richieste al minuto verso l'API (opzionale).")
+    parser.add_argument("--max_retries", type=int, default=6,
+                        help="Tentativi massimi per rate limit ed errori temporanei dell'API.")
+    parser.add_argument("--metrics_file", type=str, default=None,
+                        help="File in cui salvare le metriche per richiesta (JSONL, o Prometheus se termina con .prom).")
+    parser.add_argument("--shard_index", type=int, default=None,
+                        help="Valuta solo questo shard (da 0) del dataset; richiede --num_shards.")
+    parser.add_argument("--num_shards", type=int, default=1,
+                        help="Numero di shard; senza --shard_index esegue tutti gli shard in parallelo in locale.")
+    parser.add_argument("--shard_processes", type=int, default=None,
+                        help="Processi per l'esecuzione locale degli shard (default: uno per shard).")
+    parser.add_argument("--dry_run", action="store_true",
+                        help="Stampa il piano di esecuzione (richieste, token, costo e tempo stimati) senza inviare richieste.")
+    parser.add_argument("--keep_prompts", action="store_true",
+                        help="Salva anche i prompt quando l'output è in formato compatto (.jsonl.gz o .parquet).")
+    parser.add_argument("--context_max_tokens", type=int, default=None,
+                        help="Budget di token del contesto dei dialoghi nei prompt (troncamento centrale).")
+    parser.add_argument("--context_last_turns", type=int, default=None,
+                        help="Conserva nel prompt solo il primo turno e gli ultimi K turni del contesto.")
+    parser.add_argument("--no_cache", action="store_true", help="Disabilita la cache su disco delle risposte.")
+    parser.add_argument("--refresh_cache", action="store_true",
+                        help="Ignora le risposte in cache e le sostituisce con nuove richieste.")
+    parser.add_argument("--cache_path", type=str, default="results/cache.sqlite",
+                        help="Percorso del database SQLite della cache.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Riprende un'esecuzione interrotta saltando i risultati già salvati nel checkpoint.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed per il campionamento dei record (opzionale).")
+    parser.add_argument("--dimensions", type=str, nargs="+", default=None,
+                        help="Dimensioni da valutare in un'unica richiesta (es. 'Engaging' 'Overall' oppure 'all'). "
+                             "Richiede un template multi-dimensione.")
+    parser.add_argument("--scoring", type=str, default="single", choices=["single", "logprobs", "samples"],
+                        help="Calcolo del punteggio: discreto ('single'), atteso pesato con i logprob dei token "
+                             "('logprobs') o medio su più campioni di una sola richiesta ('samples').")
+    parser.add_argument("--num_samples", type=int, default=20,
+                        help="Numero di risposte per richiesta con --scoring samples (o come fallback di logprobs).")
+    parser.add_argument("--batch_size", type=int, default=0,
+                        help="Valuta fino a N risposte dello stesso contesto con una sola richiesta (tc_usr, pc_usr).")
+    parser.add_argument("--batch_template_path", type=str, default="prompts/usr_batch_responses.txt",
+                        help="Percorso al template per la modalità batch.")
+    parser.add_argument("--base_url", type=str, default=None,
+                        help="URL base dell'endpoint compatibile OpenAI (default: OPENAI_BASE_URL o l'endpoint predefinito).")
+    parser.add_argument("--group_by", type=str, nargs="+", default=None,
+                        help="Modalità result: campi per cui raggruppare le correlazioni (es. 'system' 'level').")
+    parser.add_argument("--bootstrap", type=int, default=0,
+                        help="Modalità result: numero di ricampionamenti bootstrap per gli intervalli di confidenza.")
+    parser.add_argument("--compare_file", type=str, default=None,
+                        help="Modalità result: secondo file di risultati da confrontare (test di permutazione).")
+    parser.add_argument("--report_processes", type=int, default=None,
+                        help="Modalità report: processi per generare grafici e tabelle (default: uno per CPU).")
+    parser.add_argument("--force_report", action="store_true",
+                        help="Modalità report: rigenera anche gli output dei risultati non modificati.")
+    parser.add_argument("--adaptive_ci_width", type=float, default=None,
+                        help="Valutazione adattiva: si ferma quando gli intervalli di confidenza delle correlazioni "
+                             "hanno ampiezza inferiore a questo valore (es. 0.1).")
+    parser.add_argument("--adaptive_batch_size", type=int, default=50,
+                        help="Valutazione adattiva: record valutati per blocco.")
+    parser.add_argument("--adaptive_max_records", type=int, default=None,
+                        help="Valutazione adattiva: numero massimo di record da valutare.")
+    parser.add_argument("--adaptive_max_cost", type=float, default=None,
+                        help="Valutazione adattiva: costo massimo stimato in USD.")
+    parser.add_argument("--output_format", type=str, default="text", choices=["text", "json"],
+                        help="Formato delle risposte del modello: 'text' (formato del template) o 'json' "
+                             "(oggetto JSON, max_tokens ridotto).")
+    parser.add_argument("--max_reasks", type=int, default=1,
+                        help="Nuove richieste al massimo per le risposte in cui mancano dei punteggi (0 per disabilitarle).")
+    parser.add_argument("--endpoints_file", type=str, default=None,
+                        help="File JSON con gli endpoint/API key tra cui distribuire le richieste "
+                             "(default: OPENAI_ENDPOINTS_FILE).")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Indirizzo di ascolto in modalità serve.")
+    parser.add_argument("--port", type=int, default=8080, help="Porta del servizio HTTP in modalità serve.")
+    parser.add_argument("--serve_max_batch_size", type=int, default=16,
+                        help="Valutazioni massime per micro-batch in modalità serve.")
+    parser.add_argument("--serve_max_wait_ms", type=float, default=5,
+                        help="Attesa massima (ms) per completare un micro-batch in modalità serve.")
+    parser.add_argument("--serve_max_pending", type=int, default=256,
+                        help="Valutazioni accodate o in corso oltre le quali il servizio risponde 503.")
     args = parser.parse_args()
+    if args.mode != "serve" and not args.input_file:
+        parser.error("--input_file è obbligatorio tranne che in modalità serve.")
+    if args.mode not in ("report", "serve") and not args.output_file:
+        parser.error("--output_file è obbligatorio tranne che in modalità report e serve.")
 
-    main(
-        mode=args.mode,
-        input_file=args.input_file,
-        single_template_path=args.single_template_path,
-        full_template_path=args.full_template_path,
-        output_file=args.output_file,
-        num_records=args.num_records,
-    )
\ No newline at end of file
+    options = cli_options(args)
+    if args.mode in EVALUATION_MODES and args.num_shards > 1 and args.shard_index is None:
+        run_sharded(options)
+    else:
+        main(**options)
@@ -0,0 +1,251 @@
+import json
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+# Prezzi in USD per milione di token: (input, input da prompt cache, output)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4-turbo": (10.00, 10.00, 30.00),
+    "gpt-4": (30.00, 30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+}
+
+
+def model_prices(model):
+    """Prezzi del modello (anche per versioni datate come "gpt-4o-mini-2024-07-18"), None se sconosciuto."""
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    matches = [name for name in MODEL_PRICES if model.startswith(name + "-")]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def estimate_cost(model, prompt_tokens, cached_tokens, completion_tokens):
+    """Costo stimato in USD di un insieme di richieste, None se il modello non ha un prezzo noto."""
+    prices = model_prices(model)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1_000_000
+
+
+def percentile(values, q):
+    """Percentile q (0-100) con interpolazione lineare; None se non ci sono valori."""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class RunMetrics:
+    """
+    Raccoglie le metriche di un'esecuzione: una voce per richiesta (latenza, token, tentativi,
+    hit della cache, errore, endpoint), gli errori di ogni endpoint, il tempo cumulato delle fasi
+    dell'evaluator (parsing, I/O) e gli esiti del parsing delle valutazioni.
+
+    Con `max_requests` (es. nel servizio di lunga durata, vedi server.py) vengono conservate solo le voci
+    delle ultime `max_requests` richieste, e le statistiche per richiesta si riferiscono a queste.
+    """
+
+    def __init__(self, max_requests=None):
+        self.started_at = time.perf_counter()
+        self.requests = deque(maxlen=max_requests) if max_requests else []
+        self.phases = defaultdict(float)
+        self.parsed = 0
+        self.parse_failures = 0
+        # Nuove richieste per risposte senza tutti i punteggi, quelle risolte e i risultati rimasti senza punteggio
+        self.reasks = 0
+        self.reask_recovered = 0
+        self.unparsed = 0
+        # {endpoint: Counter({tipo di errore: tentativi falliti})}, inclusi quelli poi riusciti altrove
+        self.endpoint_errors = defaultdict(Counter)
+
+    def record_request(self, model, latency, prompt_tokens=0, cached_tokens=0, completion_tokens=0, retries=0,
+                       cache_hit=False, error=None, endpoint=None):
+        self.requests.append({
+            "model": model,
+            "latency": latency,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "retries": retries,
+            "cache_hit": cache_hit,
+            "error": error,
+            "endpoint": endpoint,
+        })
+
+    def record_endpoint_error(self, endpoint, kind):
+        self.endpoint_errors[endpoint][kind] += 1
+
+    def record_parse(self, success):
+        self.parsed += 1
+        if not success:
+            self.parse_failures += 1
+
+    def record_reask(self, success):
+        self.reasks += 1
+        if success:
+            self.reask_recovered += 1
+
+    def record_unparsed(self, count):
+        self.unparsed += count
+
+    @contextmanager
+    def phase(self, name):
+        """Aggiunge il tempo trascorso nel blocco alla fase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started_at
+        api_requests = [request for request in self.requests if not request["cache_hit"]]
+        latencies = [request["latency"] for request in api_requests if request["error"] is None]
+
+        models = {}
+        for request in api_requests:
+            stats = models.setdefault(request["model"], {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0,
+                                                         "completion_tokens": 0})
+            stats["requests"] += 1
+            for field in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+                stats[field] += request[field]
+        for model, stats in models.items():
+            stats["cost_usd"] = estimate_cost(model, stats["prompt_tokens"], stats["cached_tokens"],
+                                              stats["completion_tokens"])
+
+        endpoints = {}
+        for name in dict.fromkeys([request["endpoint"] for request in api_requests] + list(self.endpoint_errors)):
+            served = [request for request in api_requests if request["endpoint"] == name]
+            endpoint_latencies = [request["latency"] for request in served if request["error"] is None]
+            endpoints[name] = {
+                "requests": len(served),
+                "share": len(served) / len(api_requests) if api_requests else 0.0,
+                "errors": sum(request["error"] is not None for request in served),
+                "failed_attempts": dict(self.endpoint_errors.get(name, {})),
+                "latency_p50": percentile(endpoint_latencies, 50),
+                "prompt_tokens": sum(request["prompt_tokens"] for request in served),
+                "completion_tokens": sum(request["completion_tokens"] for request in served),
+            }
+
+        return {
+            "elapsed_seconds": elapsed,
+            "requests": len(self.requests),
+            "api_requests": len(api_requests),
+            "cache_hits": len(self.requests) - len(api_requests),
+            "errors": sum(request["error"] is not None for request in api_requests),
+            "retries": sum(request["retries"] for request in api_requests),
+            "requests_per_second": len(self.requests) / elapsed if elapsed else 0.0,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p90": percentile(latencies, 90),
+            "latency_p99": percentile(latencies, 99),
+            "latency_max": max(latencies) if latencies else None,
+            "api_seconds": sum(request["latency"] for request in api_requests),
+            "phase_seconds": dict(self.phases),
+            "parsed": self.parsed,
+            "parse_failures": self.parse_failures,
+            "reasks": self.reasks,
+            "reask_recovered": self.reask_recovered,
+            "unparsed": self.unparsed,
+            "models": models,
+            "endpoints": endpoints,
+            "cost_usd": sum(stats["cost_usd"] or 0.0 for stats in models.values()),
+        }
+
+    def print_report(self):
+        summary = self.summary()
+        if not summary["requests"]:
+            return
+        print(f"\nRichieste: {summary['requests']} ({summary['cache_hits']} dalla cache, {summary['retries']} ritentativi, "
+              f"{summary['errors']} errori) in {summary['elapsed_seconds']:.1f}s "
+              f"({summary['requests_per_second']:.2f} richieste/s)")
+        if summary["latency_p50"] is not None:
+            print(f"Latenza API: p50 {summary['latency_p50']:.2f}s, p90 {summary['latency_p90']:.2f}s, "
+                  f"p99 {summary['latency_p99']:.2f}s, max {summary['latency_max']:.2f}s")
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in summary["phase_seconds"].items())
+        print(f"Tempo cumulato: attesa API {summary['api_seconds']:.1f}s" + (f", {phases}" if phases else ""))
+        if summary["parsed"]:
+            print(f"Parsing fallito: {summary['parse_failures']} su {summary['parsed']} valutazioni "
+                  f"({100 * summary['parse_failures'] / summary['parsed']:.1f}%); nuove richieste del formato "
+                  f"{summary['reasks']} (riuscite {summary['reask_recovered']}), risultati senza punteggio "
+                  f"{summary['unparsed']}")
+        for model, stats in summary["models"].items():
+            cost = f"${stats['cost_usd']:.4f}" if stats["cost_usd"] is not None else "costo non disponibile"
+            print(f"{model}: {stats['requests']} richieste, token di input {stats['prompt_tokens']} "
+                  f"(di cui da prompt cache: {stats['cached_tokens']}), token di output {stats['completion_tokens']}, "
+                  f"{cost}")
+        if len(summary["endpoints"]) > 1:
+            for name, stats in summary["endpoints"].items():
+                latency = f", p50 {stats['latency_p50']:.2f}s" if stats["latency_p50"] is not None else ""
+                failed = ", ".join(f"{kind} {count}" for kind, count in stats["failed_attempts"].items())
+                print(f"Endpoint {name}: {stats['requests']} richieste ({100 * stats['share']:.1f}%){latency}, "
+                      f"{stats['errors']} errori" + (f", tentativi falliti: {failed}" if failed else ""))
+
+    def write(self, path):
+        """
+        Salva le metriche: formato testuale Prometheus se `path` termina con ".prom", altrimenti JSONL
+        con una riga per richiesta e una riga finale {"summary": ...}.
+        """
+        if path.endswith(".prom"):
+            with open(path, "w") as f:
+                f.write(self.prometheus())
+            return
+        with open(path, "w") as f:
+            for request in self.requests:
+                f.write(json.dumps(request) + "\n")
+            f.write(json.dumps({"summary": self.summary()}) + "\n")
+
+    def prometheus(self):
+        summary = self.summary()
+        lines = [
+            "# TYPE geval_requests_total counter",
+            f"geval_requests_total {summary['requests']}",
+            "# TYPE geval_cache_hits_total counter",
+            f"geval_cache_hits_total {summary['cache_hits']}",
+            "# TYPE geval_errors_total counter",
+            f"geval_errors_total {summary['errors']}",
+            "# TYPE geval_retries_total counter",
+            f"geval_retries_total {summary['retries']}",
+            "# TYPE geval_parse_failures_total counter",
+            f"geval_parse_failures_total {summary['parse_failures']}",
+            "# TYPE geval_reasks_total counter",
+            f"geval_reasks_total {summary['reasks']}",
+            "# TYPE geval_reask_recovered_total counter",
+            f"geval_reask_recovered_total {summary['reask_recovered']}",
+            "# TYPE geval_unparsed_results gauge",
+            f"geval_unparsed_results {summary['unparsed']}",
+            "# TYPE geval_run_seconds gauge",
+            f"geval_run_seconds {summary['elapsed_seconds']:.3f}",
+            "# TYPE geval_request_latency_seconds summary",
+        ]
+        for q in (50, 90, 99):
+            value = summary[f"latency_p{q}"]
+            if value is not None:
+                lines.append(f'geval_request_latency_seconds{{quantile="{q / 100}"}} {value:.4f}')
+        lines.append(f"geval_request_latency_seconds_sum {summary['api_seconds']:.4f}")
+        lines.append(f"geval_request_latency_seconds_count {summary['api_requests']}")
+        lines.append("# TYPE geval_phase_seconds gauge")
+        for name, seconds in summary["phase_seconds"].items():
+            lines.append(f'geval_phase_seconds{{phase="{name}"}} {seconds:.4f}')
+        lines.append("# TYPE geval_tokens_total counter")
+        for model, stats in summary["models"].items():
+            for kind in ("prompt", "cached", "completion"):
+                lines.append(f'geval_tokens_total{{model="{model}",kind="{kind}"}} {stats[f"{kind}_tokens"]}')
+        lines.append("# TYPE geval_endpoint_requests_total counter")
+        for name, stats in summary["endpoints"].items():
+            lines.append(f'geval_endpoint_requests_total{{endpoint="{name}"}} {stats["requests"]}')
+        lines.append("# TYPE geval_endpoint_failed_attempts_total counter")
+        for name, stats in summary["endpoints"].items():
+            for kind, count in stats["failed_attempts"].items():
+                lines.append(f'geval_endpoint_failed_attempts_total{{endpoint="{name}",kind="{kind}"}} {count}')
+        lines.append("# TYPE geval_cost_usd gauge")
+        for model, stats in summary["models"].items():
+            if stats["cost_usd"] is not None:
+                lines.append(f'geval_cost_usd{{model="{model}"}} {stats["cost_usd"]:.6f}')
+        return "\n".join(lines) + "\n"
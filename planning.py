@@ -0,0 +1,120 @@
+import hashlib
+import json
+from metrics import estimate_cost
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Token aggiuntivi per messaggio (ruolo e delimitatori) e per l'avvio della risposta nel formato chat
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_PER_REPLY = 3
+# Token tipici di una riga "<Dimensione>: <score>" nella risposta
+_TOKENS_PER_SCORE_LINE = 6
+# Latenza ipotizzata per richiesta quando non ne sono ancora state misurate
+DEFAULT_LATENCY = 1.5
+
+_encodings = {}
+
+
+class DryRun(Exception):
+    """Sollevata da `run_evaluations` con `dry_run=True` dopo aver stampato il piano, prima di ogni richiesta."""
+
+    def __init__(self, plan):
+        super().__init__("Dry run: nessuna richiesta inviata")
+        self.plan = plan
+
+
+def prompt_key(prompt):
+    """Hash SHA-256 di un prompt (stringa o lista di messaggi): prompt identici hanno la stessa chiave."""
+    return hashlib.sha256(json.dumps(prompt, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _encoding(model):
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("o200k_base")
+    return _encodings[model]
+
+
+def count_text_tokens(text, model="gpt-4o-mini"):
+    """Token di un testo: tokenizer del modello se tiktoken è installato, altrimenti circa 4 caratteri per token."""
+    if tiktoken is not None:
+        return len(_encoding(model).encode(text))
+    return max(1, round(len(text) / 4)) if text else 0
+
+
+def count_tokens(prompt, model="gpt-4o-mini"):
+    """Token di input stimati di un prompt (stringa, inviata come messaggio system, o lista di messaggi)."""
+    messages = prompt if isinstance(prompt, list) else [{"role": "system", "content": prompt}]
+    return _TOKENS_PER_REPLY + sum(_TOKENS_PER_MESSAGE + count_text_tokens(message["content"], model)
+                                   for message in messages)
+
+
+def plan_requests(g_eval, prompts, request_options, num_scores=1):
+    """
+    Piano di esecuzione di un insieme di prompt: prompt unici, già in cache, token e costo stimati e
+    tempo previsto con la concorrenza e il limite di richieste al minuto di `g_eval`.
+
+    Args:
+        g_eval (GEvalAPI): Client che eseguirà le richieste.
+        prompts (list): Prompt da inviare (anche ripetuti).
+        request_options (dict): Parametri delle richieste (n, max_tokens, temperature, top_logprobs,
+            response_format e fallback, le opzioni a campioni per gli endpoint senza logprob).
+        num_scores (int): Righe di punteggio attese per risposta (per stimare i token di output).
+
+    Returns:
+        dict: prompts, unique, cached, requests, prompt_tokens, completion_tokens, cost_usd, seconds.
+    """
+    unique = {prompt_key(prompt): prompt for prompt in prompts}
+    n = request_options.get("n", 1)
+    max_tokens = request_options.get("max_tokens", 50)
+
+    cached = 0
+    prompt_tokens = 0
+    for prompt in unique.values():
+        if g_eval.cache is not None:
+            candidates = [g_eval.request_kwargs(prompt, n, max_tokens, request_options.get("temperature", 0),
+                                                request_options.get("top_logprobs"),
+                                                request_options.get("response_format"))]
+            if request_options.get("top_logprobs") and request_options.get("fallback"):
+                # Risposta a campioni già ottenuta da un endpoint senza logprob
+                candidates.append(g_eval.fallback_kwargs(prompt, request_options["fallback"], max_tokens))
+            if any(g_eval.cache.contains(key) for kwargs in candidates for _, key in g_eval.cache_keys(kwargs)):
+                cached += 1
+                continue
+        prompt_tokens += count_tokens(prompt, g_eval.model)
+
+    requests = len(unique) - cached
+    completion_tokens = requests * n * min(max_tokens, _TOKENS_PER_SCORE_LINE * num_scores)
+    latency = g_eval.metrics.summary()["latency_p50"] or DEFAULT_LATENCY
+    seconds = requests * latency / max(1, g_eval.max_concurrency)
+    if g_eval.requests_per_minute:
+        seconds = max(seconds, 60 * requests / g_eval.requests_per_minute)
+
+    return {
+        "prompts": len(prompts),
+        "unique": len(unique),
+        "cached": cached,
+        "requests": requests,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": estimate_cost(g_eval.model, prompt_tokens, 0, completion_tokens),
+        "seconds": seconds,
+        "model": g_eval.model,
+    }
+
+
+def print_plan(plan, title="Piano di esecuzione"):
+    tokenizer = "tiktoken" if tiktoken is not None else "stima ~4 caratteri/token"
+    cost = f"${plan['cost_usd']:.4f}" if plan["cost_usd"] is not None else "non disponibile"
+    print(f"\n{title}:")
+    print(f"  Prompt: {plan['prompts']} ({plan['unique']} unici, {plan['prompts'] - plan['unique']} duplicati, "
+          f"{plan['cached']} già in cache)")
+    print(f"  Richieste API: {plan['requests']}")
+    print(f"  Token stimati: input {plan['prompt_tokens']}, output ~{plan['completion_tokens']} ({tokenizer})")
+    print(f"  Costo stimato ({plan['model']}): {cost}")
+    print(f"  Tempo stimato: {plan['seconds'] / 60:.1f} min")
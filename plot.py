@@ -1,37 +1,12 @@
-import json
 import matplotlib.pyplot as plt
 import pandas as pd
-from scipy.stats import pearsonr, spearmanr, kendalltau
+from correlations import analysis_columns, calculate_correlations, load_results
 
 def load_dataset(file_path):
     """
-    Carica i dati dal file JSON.
+    Carica i risultati (.json, .jsonl.gz o .parquet) leggendo solo le colonne dei punteggi.
     """
-    with open(file_path, 'r') as f:
-        data = json.load(f)
-    return data
-
-def calculate_correlations(data):
-    """
-    Calcola le correlazioni tra overall_score e evaluation["Overall"].
-    """
-    human_scores = []
-    model_scores = []
-
-    for entry in data:
-        human_score = entry.get("overall_score")
-        model_score = entry.get("evaluation", {}).get("Overall")
-
-        if human_score is not None and model_score is not None:
-            human_scores.append(human_score)
-            model_scores.append(model_score)
-
-    # Calcolo delle correlazioni
-    pearson_corr, _ = pearsonr(human_scores, model_scores)
-    spearman_corr, _ = spearmanr(human_scores, model_scores)
-    kendall_corr, _ = kendalltau(human_scores, model_scores)
-
-    return pearson_corr, spearman_corr, kendall_corr
+    return load_results(file_path, columns=analysis_columns())
 
 def plot_correlations(correlations, output_path):
     """
@@ -0,0 +1,193 @@
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+from results_io import FORMATS, split_extension
+
+# Da incrementare quando cambia il contenuto dei grafici o delle tabelle: invalida i report già generati
+REPORT_VERSION = 1
+# File in cui ogni cartella conserva l'hash dei risultati da cui è stato generato ogni output
+MANIFEST_NAME = ".report.json"
+
+FIGURES = ("correlation_bar_plot.png", "scatter_plot.png", "boxplot.png", "difference_histogram.png")
+TABLES = ("correlations.txt", "summary_table.csv")
+
+
+def results_files(folder):
+    """File di risultati di una cartella (esclusi gli shard, che vanno prima uniti con la modalità merge)."""
+    paths = [path for extension in FORMATS for path in glob.glob(os.path.join(folder, f"*{extension}"))]
+    return sorted(path for path in set(paths) if ".shard-" not in os.path.basename(path))
+
+
+def input_hash(path):
+    """Hash SHA-256 del file di risultati (letto a blocchi) e della versione del report."""
+    digest = hashlib.sha256(f"report-v{REPORT_VERSION}".encode("utf-8"))
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def output_names(path, prefixed):
+    """Nomi degli output di un file di risultati; con più file nella cartella sono preceduti dal nome del file."""
+    prefix = f"{os.path.basename(split_extension(path)[0])}_" if prefixed else ""
+    return [prefix + name for name in FIGURES + TABLES]
+
+
+def _load_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def plan_report(folders, force=False):
+    """
+    Individua i file di risultati da (ri)elaborare: quelli con almeno un output mancante o generato
+    da un contenuto diverso (hash nel manifest della cartella).
+
+    Returns:
+        list[dict]: Un job per file con path, hash e nomi degli output.
+    """
+    jobs = []
+    for folder in folders:
+        manifest = _load_manifest(folder)
+        paths = results_files(folder)
+        for path in paths:
+            digest = input_hash(path)
+            names = output_names(path, prefixed=len(paths) > 1)
+            stale = [name for name in names
+                     if force or manifest.get(name) != digest or not os.path.exists(os.path.join(folder, name))]
+            if stale:
+                jobs.append({"folder": folder, "path": path, "hash": digest, "outputs": stale})
+            else:
+                print(f"{path}: report invariato, saltato")
+    return jobs
+
+
+def _correlations_text(correlations):
+    """Tabella testuale delle correlazioni nello stesso stile di results/*/correlations.txt."""
+    headers = ["Pearson", "Spearman", "Kendall"]
+    values = [f"{value:.4f}" for value in correlations]
+    widths = [max(len(header), len(value)) + 2 for header, value in zip(headers, values)]
+    separator = "+" + "+".join("-" * width for width in widths) + "+"
+    row = lambda cells: "|" + "|".join(cell.center(width) for cell, width in zip(cells, widths)) + "|"
+    return "\n".join([separator, row(headers), separator, row(values), separator])
+
+
+def build_report(job):
+    """
+    Genera grafici e tabelle di un file di risultati (eseguito nei processi worker).
+    Usa il backend non interattivo Agg: nessuna finestra viene aperta.
+
+    Returns:
+        dict: Il job con i nomi degli output effettivamente scritti in "written".
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from correlations import analysis_columns, calculate_correlations, load_results, score_columns
+
+    frame = load_results(job["path"], columns=analysis_columns())
+    human_column, model_column = score_columns()
+    dimensions = [column for column in frame.columns if column.startswith("evaluation.")]
+    if model_column not in frame and dimensions:
+        # Risultati multi-dimensione senza Overall: si usa la media delle dimensioni valutate
+        frame[model_column] = frame[dimensions].mean(axis=1)
+    if human_column not in frame or model_column not in frame:
+        print(f"{job['path']}: punteggi mancanti, report saltato")
+        return dict(job, written=[])
+    frame = frame[frame[human_column].notna() & frame[model_column].notna()]
+    human = frame[human_column].to_numpy(dtype=float)
+    model = frame[model_column].to_numpy(dtype=float)
+    correlations = calculate_correlations(frame)
+    labels = ["Pearson", "Spearman", "Kendall-Tau"]
+
+    written = []
+    for name in job["outputs"]:
+        output_path = os.path.join(job["folder"], name)
+        if name.endswith("correlations.txt"):
+            with open(output_path, "w") as f:
+                f.write(_correlations_text(correlations))
+        elif name.endswith("summary_table.csv"):
+            with open(output_path, "w") as f:
+                f.write("Metric,Value\n" + "".join(f"{label},{value}\n" for label, value in zip(labels, correlations)))
+        else:
+            fig, ax = plt.subplots(figsize=(8, 6))
+            if name.endswith("correlation_bar_plot.png"):
+                bars = ax.bar(labels, correlations, color=["blue", "orange", "green"])
+                for bar, value in zip(bars, correlations):
+                    ax.text(bar.get_x() + bar.get_width() / 2, bar.get_height(), f"{value:.4f}", ha="center",
+                            va="bottom")
+                ax.set_ylim(0, 1)
+                ax.set_xlabel("Tipi di correlazione")
+                ax.set_ylabel("Valore della correlazione")
+                ax.set_title("Correlazioni tra Evaluation Mean e Overall Score")
+                ax.grid(axis="y", linestyle="--", alpha=0.7)
+            elif name.endswith("scatter_plot.png"):
+                ax.scatter(human, model, alpha=0.5)
+                ax.set_xlabel("Overall Score (umano)")
+                ax.set_ylabel("Evaluation (G-EVAL)")
+                ax.set_title("Punteggi umani e del modello")
+                ax.grid(linestyle="--", alpha=0.7)
+            elif name.endswith("boxplot.png"):
+                levels = np.unique(np.round(human))
+                ax.boxplot([model[np.round(human) == level] for level in levels])
+                ax.set_xticks(range(1, len(levels) + 1), [f"{level:g}" for level in levels])
+                ax.set_xlabel("Overall Score (umano, arrotondato)")
+                ax.set_ylabel("Evaluation (G-EVAL)")
+                ax.set_title("Distribuzione dei punteggi del modello per punteggio umano")
+            elif name.endswith("difference_histogram.png"):
+                ax.hist(model - human, bins=20, color="purple", alpha=0.7)
+                ax.set_xlabel("Evaluation - Overall Score")
+                ax.set_ylabel("Frequenza")
+                ax.set_title("Distribuzione delle differenze tra Evaluation e Overall Score")
+                ax.grid(axis="y", linestyle="--", alpha=0.7)
+            fig.savefig(output_path)
+            plt.close(fig)
+        written.append(name)
+    return dict(job, written=written)
+
+
+def run_report(folders, processes=None, force=False):
+    """
+    Genera grafici e tabelle per ogni file di risultati delle cartelle indicate, in processi separati,
+    saltando gli output il cui file di risultati non è cambiato dall'ultima generazione.
+
+    Returns:
+        list[str]: Percorsi degli output scritti.
+    """
+    jobs = plan_report(folders, force)
+    if not jobs:
+        return []
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(min(processes or os.cpu_count() or 1, len(jobs))) as pool:
+        done = pool.map(build_report, jobs)
+
+    written = []
+    for folder in sorted({job["folder"] for job in done}):
+        manifest = _load_manifest(folder)
+        for job in done:
+            if job["folder"] == folder:
+                manifest.update({name: job["hash"] for name in job["written"]})
+                written.extend(os.path.join(folder, name) for name in job["written"])
+        with open(os.path.join(folder, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+    return written
+
+
+def report_folders(pattern):
+    """Cartelle da elaborare: `pattern` può essere una cartella di risultati, la cartella radice o un glob."""
+    folders = sorted(path for path in glob.glob(pattern) if os.path.isdir(path))
+    expanded = []
+    for folder in folders:
+        if results_files(folder):
+            expanded.append(folder)
+        expanded.extend(sorted(path for path in glob.glob(os.path.join(folder, "*"))
+                               if os.path.isdir(path) and results_files(path)))
+    if not expanded:
+        raise ValueError(f"Nessuna cartella di risultati trovata per {pattern}")
+    return expanded
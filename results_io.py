@@ -0,0 +1,169 @@
+import gzip
+import hashlib
+import json
+import os
+
+# Estensioni dei formati di risultati supportati (la prima che corrisponde determina il formato)
+FORMATS = {".jsonl.gz": "jsonl.gz", ".parquet": "parquet", ".json": "json"}
+
+_TEMPLATES_METADATA = b"geval.templates"
+
+
+def results_format(path):
+    """Formato di un file di risultati in base all'estensione (json, jsonl.gz o parquet)."""
+    for extension, name in FORMATS.items():
+        if path.endswith(extension):
+            return name
+    raise ValueError(f"Formato dei risultati non supportato: {path} (usa .json, .jsonl.gz o .parquet)")
+
+
+def split_extension(path):
+    """Come `os.path.splitext`, ma riconosce anche estensioni composte come ".jsonl.gz"."""
+    for extension in FORMATS:
+        if path.endswith(extension):
+            return path[:-len(extension)], extension
+    return os.path.splitext(path)
+
+
+def template_key(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def compact_record(result, templates, keep_prompts=False):
+    """
+    Versione compatta di un risultato: il prompt viene sostituito dall'hash della parte statica
+    (messaggi system, salvata una sola volta in `templates`) e, se `keep_prompts`, dal solo messaggio user.
+    """
+    record = {key: value for key, value in result.items() if key != "prompt"}
+    prompt = result.get("prompt")
+    if prompt is None:
+        return record
+    messages = prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}]
+    system = "\n".join(message["content"] for message in messages if message["role"] == "system")
+    if system:
+        key = template_key(system)
+        templates.setdefault(key, system)
+        record["template"] = key
+    if keep_prompts:
+        record["prompt_user"] = "\n".join(message["content"] for message in messages if message["role"] != "system")
+    return record
+
+
+def expand_record(record, templates):
+    """Ricostruisce il campo "prompt" di un risultato compatto salvato con i prompt."""
+    if "prompt_user" not in record:
+        return record
+    record = dict(record)
+    messages = []
+    if record.get("template") in templates:
+        messages.append({"role": "system", "content": templates[record["template"]]})
+    messages.append({"role": "user", "content": record.pop("prompt_user")})
+    record["prompt"] = messages
+    return record
+
+
+def _unflatten(row):
+    """Riporta le colonne "a.b" di una riga Parquet in dizionari annidati, scartando i valori mancanti."""
+    record = {}
+    for column, value in row.items():
+        if value is None or (isinstance(value, float) and value != value):
+            continue
+        target = record
+        *parents, leaf = column.split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[leaf] = value.tolist() if hasattr(value, "tolist") else value
+    return record
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Il formato Parquet richiede pyarrow: pip install pyarrow") from None
+    return pyarrow, pyarrow.parquet
+
+
+def write_results(results, path, keep_prompts=False, templates=None):
+    """
+    Salva i risultati nel formato indicato dall'estensione di `path`:
+    - .json: lista JSON indentata con i prompt completi (formato storico);
+    - .jsonl.gz: una riga di intestazione {"templates": {hash: testo}} seguita da un risultato compatto per riga;
+    - .parquet: colonne tipizzate (punteggi, id, livello, ...) con i template nei metadati del file.
+
+    `templates` aggiunge template già noti (es. letti da altri file compatti con `read_templates`).
+    """
+    format_name = results_format(path)
+    if format_name == "json":
+        with open(path, "w") as f:
+            json.dump(results, f, indent=4)
+        return
+
+    templates = dict(templates or {})
+    records = [compact_record(result, templates, keep_prompts) for result in results]
+    if format_name == "jsonl.gz":
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"templates": templates}, ensure_ascii=False) + "\n")
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return
+
+    from correlations import results_frame
+
+    pa, pq = _require_pyarrow()
+    table = pa.Table.from_pandas(results_frame(records), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_TEMPLATES_METADATA] = json.dumps(templates, ensure_ascii=False).encode("utf-8")
+    pq.write_table(table.replace_schema_metadata(metadata), path, compression="zstd")
+
+
+def read_templates(path):
+    """Template (testo della parte statica dei prompt) salvati in un file compatto, indicizzati per hash."""
+    format_name = results_format(path)
+    if format_name == "jsonl.gz":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.loads(f.readline()).get("templates", {})
+    if format_name == "parquet":
+        _, pq = _require_pyarrow()
+        metadata = pq.read_schema(path).metadata or {}
+        return json.loads(metadata.get(_TEMPLATES_METADATA, b"{}"))
+    return {}
+
+
+def read_results(path, keep_prompts=False):
+    """
+    Carica i risultati come lista di dizionari da un file .json, .jsonl.gz o .parquet.
+    Nei formati compatti il prompt è ricostruito solo se `keep_prompts` (e se era stato salvato).
+    """
+    format_name = results_format(path)
+    if format_name == "json":
+        with open(path, "r") as f:
+            return json.load(f)
+    if format_name == "jsonl.gz":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            templates = json.loads(f.readline()).get("templates", {})
+            records = [json.loads(line) for line in f if line.strip()]
+    else:
+        templates = read_templates(path)
+        records = [_unflatten(row) for row in read_frame(path).to_dict("records")]
+        # La colonna "key" è derivata (vedi `result_key`) e non fa parte del risultato
+        records = [{key: value for key, value in record.items() if key != "key"} for record in records]
+    if keep_prompts:
+        return [expand_record(record, templates) for record in records]
+    return [{key: value for key, value in record.items() if key != "prompt_user"} for record in records]
+
+
+def read_frame(path, columns=None):
+    """
+    Carica un file Parquet come DataFrame leggendo solo le colonne richieste (memory-mapped).
+    `columns` può contenere nomi esatti o prefissi che terminano con "." (es. "evaluation.").
+    """
+    import pandas as pd
+
+    _, pq = _require_pyarrow()
+    if columns is not None:
+        names = pq.read_schema(path).names
+        columns = [name for name in names
+                   if name in columns or any(prefix.endswith(".") and name.startswith(prefix) for prefix in columns)]
+    return pd.read_parquet(path, columns=columns, memory_map=True)
@@ -0,0 +1,197 @@
+import asyncio
+import random
+import re
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+import openai
+
+RATE_LIMIT = "rate_limit"
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def classify_error(error):
+    """
+    Classifica un errore dell'API: RATE_LIMIT (429), TRANSIENT (timeout, connessione, 5xx, 408/409)
+    oppure FATAL (richiesta non valida, autenticazione, ... — inutile ritentare).
+    """
+    if isinstance(error, openai.RateLimitError):
+        return RATE_LIMIT
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return TRANSIENT
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code == 429:
+            return RATE_LIMIT
+        if error.status_code >= 500 or error.status_code in (408, 409):
+            return TRANSIENT
+    return FATAL
+
+
+def _parse_duration(value):
+    """Converte durate come "1s", "6m0s", "20ms" o "0.5" in secondi."""
+    try:
+        return float(value)
+    except ValueError:
+        parts = _DURATION.findall(value)
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts) if parts else None
+
+
+def header_delay(error):
+    """
+    Attesa suggerita dal provider negli header della risposta di errore: retry-after-ms, Retry-After
+    (secondi o data HTTP) e, se il limite è esaurito, x-ratelimit-reset-requests/tokens.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    delays = []
+    if headers.get("retry-after-ms"):
+        delays.append(_parse_duration(headers["retry-after-ms"]) / 1000)
+    if headers.get("retry-after"):
+        retry_after = _parse_duration(headers["retry-after"])
+        if retry_after is None:
+            try:
+                retry_after = parsedate_to_datetime(headers["retry-after"]).timestamp() - time.time()
+            except (TypeError, ValueError):
+                retry_after = None
+        delays.append(retry_after)
+    for limit in ("requests", "tokens"):
+        if headers.get(f"x-ratelimit-remaining-{limit}") == "0" and headers.get(f"x-ratelimit-reset-{limit}"):
+            delays.append(_parse_duration(headers[f"x-ratelimit-reset-{limit}"]))
+
+    delays = [delay for delay in delays if delay is not None]
+    return max(0.0, max(delays)) if delays else None
+
+
+def backoff_delay(attempt, base=1.0, maximum=60.0):
+    """Backoff esponenziale con full jitter: un valore casuale in [0, min(maximum, base * 2^attempt)]."""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+def retry_delay(error, kind, attempt, base=1.0, maximum=60.0):
+    """Attesa prima del prossimo tentativo: gli header del provider hanno la precedenza sul backoff."""
+    if kind == RATE_LIMIT:
+        suggested = header_delay(error)
+        if suggested is not None:
+            # Un po' di jitter evita che tutti i worker ripartano nello stesso istante
+            return min(maximum, suggested) + random.uniform(0, base)
+    return backoff_delay(attempt, base, maximum)
+
+
+class TokenBucket:
+    """
+    Limitatore token-bucket per il numero di richieste al minuto.
+
+    Il bucket si ricarica in modo continuo a `requests_per_minute / 60` token al secondo
+    fino a `capacity`; ogni richiesta consuma un token e attende se il bucket è vuoto.
+    """
+
+    def __init__(self, requests_per_minute, capacity=None):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1, int(requests_per_minute // 60))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class CircuitBreaker:
+    """
+    Interruttore condiviso dai worker: se nelle ultime `window` richieste la frazione di errori temporanei
+    (timeout, 5xx) supera `threshold`, tutti i worker vengono sospesi per `cooldown` secondi prima di riprovare.
+    """
+
+    def __init__(self, window=20, threshold=0.5, cooldown=30.0, min_calls=10):
+        self.outcomes = deque(maxlen=window)
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.min_calls = min_calls
+        self.open_until = 0.0
+
+    def record(self, success):
+        self.outcomes.append(success)
+        failures = self.outcomes.count(False)
+        if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.threshold:
+            self.open_until = time.monotonic() + self.cooldown
+            self.outcomes.clear()
+            print(f"Troppi errori API ({failures} nelle ultime richieste): pausa di {self.cooldown:.0f}s")
+
+
+class AdaptiveLimiter:
+    """
+    Limite di concorrenza adattivo (AIMD): si dimezza a ogni 429 (al più una volta ogni
+    `decrease_interval` secondi, così una raffica di 429 simultanei conta una volta sola) e risale
+    di uno dopo `limit` successi consecutivi, fino a `max_limit`.
+    """
+
+    def __init__(self, max_limit, decrease_interval=1.0):
+        self.max_limit = max_limit
+        self.decrease_interval = decrease_interval
+        self.decreased_at = float("-inf")
+        self.limit = max_limit
+        self.in_flight = 0
+        self.successes = 0
+        # Coda FIFO: a ogni rilascio viene svegliato solo il primo in attesa
+        self._waiters = deque()
+
+    async def __aenter__(self):
+        if self.in_flight >= self.limit or self._waiters:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    # Lo slot era già stato assegnato: va restituito
+                    self.in_flight -= 1
+                    self._wake()
+                raise
+        else:
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def on_success(self):
+        self.successes += 1
+        if self.limit < self.max_limit and self.successes >= self.limit:
+            self.limit += 1
+            self.successes = 0
+            self._wake()
+
+    def on_rate_limit(self):
+        self.successes = 0
+        now = time.monotonic()
+        if self.limit > 1 and now - self.decreased_at >= self.decrease_interval:
+            self.decreased_at = now
+            self.limit = max(1, self.limit // 2)
+            print(f"Rate limit: concorrenza ridotta a {self.limit}")
@@ -0,0 +1,409 @@
+import asyncio
+import json
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from evaluators.common import (MAX_REASKS, answer_text, build_multi_template, format_batch_responses, format_prompt,
+                               parse_batch_scores, parse_scores, reask_instruction, reask_prompt, score_evaluations,
+                               scoring_options)
+from evaluators.context_window import window_turns
+from g_eval import PromptTemplate
+from metrics import RunMetrics, percentile
+from planning import prompt_key
+from retry import TokenBucket
+
+# Voci per richiesta conservate nelle metriche del servizio (le statistiche riguardano le più recenti)
+METRICS_WINDOW = 10000
+
+
+class Overloaded(Exception):
+    """Coda del servizio piena: la valutazione va ripetuta più tardi (HTTP 503)."""
+
+
+class ScoringService:
+    """
+    Servizio di valutazione di lunga durata attorno a `GEvalAPI`: client HTTP e template restano caricati
+    e le richieste in arrivo (da più thread) vengono raccolte in micro-batch, al massimo `max_batch_size`
+    valutazioni o `max_wait_ms` millisecondi dopo la prima.
+
+    In un micro-batch i prompt identici vengono inviati una sola volta, così come le richieste identiche
+    ancora in corso di batch diversi; la cache su disco di `g_eval` è condivisa da tutte le richieste. Con
+    `batch_template_path` le risposte con lo stesso contesto sono valutate con un'unica richiesta (come la
+    modalità batch di tc_usr e pc_usr). Le valutazioni accodate o in corso sono al massimo `max_pending`:
+    oltre questo limite `submit` solleva `Overloaded`.
+
+    Le richieste vengono eseguite nell'event loop del pool di `g_eval`, in un thread dedicato (vedi `start`).
+    """
+
+    def __init__(self, g_eval, template_path, dimensions=None, scoring="single", num_samples=20,
+                 output_format="text", max_reasks=MAX_REASKS, batch_template_path=None, context_window=None,
+                 max_batch_size=16, max_wait_ms=5, max_pending=256):
+        if dimensions == ["all"]:
+            raise ValueError("Il servizio richiede l'elenco esplicito delle dimensioni da valutare.")
+        if max_batch_size < 1 or max_pending < 1:
+            raise ValueError("max_batch_size e max_pending devono essere almeno 1.")
+        self.g_eval = g_eval
+        # Il servizio resta attivo a lungo: le metriche conservano solo le richieste più recenti
+        g_eval.metrics = RunMetrics(max_requests=METRICS_WINDOW)
+        self.dimensions = list(dimensions or ["Overall"])
+        template = g_eval.load_prompt_template(template_path)
+        if dimensions:
+            template = build_multi_template(template, self.dimensions)
+        self.template = PromptTemplate(template)
+        self.batch_template = None
+        if batch_template_path:
+            if self.dimensions != ["Overall"] or scoring != "single" or output_format != "text":
+                raise ValueError("La modalità batch supporta solo Overall con scoring 'single' e output testuale.")
+            self.batch_template = PromptTemplate(g_eval.load_prompt_template(batch_template_path))
+        self.scoring = scoring
+        self.output_format = output_format
+        self.max_reasks = max_reasks
+        self.context_window = context_window
+        self.options, self.sample_options, self.reask_options = scoring_options(scoring, num_samples, output_format,
+                                                                                 len(self.dimensions))
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._inflight = {}
+        self._queue = None
+        self._loop = None
+        self._thread = None
+        self._bucket = None
+        # Contatori del servizio (monotoni) e latenze delle valutazioni più recenti
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "batches": 0, "batched": 0,
+                      "batch_requests": 0, "deduplicated": 0}
+        self.latencies = deque(maxlen=METRICS_WINDOW)
+
+    def start(self):
+        """Avvia il thread del micro-batcher e attende che l'event loop sia pronto."""
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self.g_eval.pool.run, args=(self._serve(ready),), daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        """Completa le valutazioni già accodate, ferma il micro-batcher e chiude i client."""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+        self._thread.join()
+        self._thread = None
+        self.g_eval.close()
+
+    def submit(self, context, response, fact=None):
+        """
+        Accoda la valutazione di una risposta (da qualsiasi thread).
+
+        Args:
+            context (str | list[str]): Contesto del dialogo, come testo o lista di turni (a cui si applica
+                `context_window`, se presente).
+            response (str): Risposta da valutare.
+            fact (str, opzionale): Fatto di supporto, per i template che lo usano.
+
+        Returns:
+            concurrent.futures.Future: Il risultato, con "evaluation" e, nelle modalità pesate, "score_variance".
+        """
+        if self._loop is None:
+            raise RuntimeError("Servizio non avviato: chiamare start().")
+        if not isinstance(response, str) or not (isinstance(context, str) or
+                                                 isinstance(context, list) and all(isinstance(turn, str)
+                                                                                   for turn in context)):
+            raise ValueError("'context' (testo o lista di turni) e 'response' (testo) sono obbligatori.")
+        result = {"context": context, "response": response, "evaluation": {dimension: None
+                                                                           for dimension in self.dimensions}}
+        if isinstance(context, list):
+            turns, window_info = window_turns(self.context_window, context)
+            context = " ".join(turns)
+            if window_info:
+                result["context_window"] = window_info
+        result["prompt"] = self.g_eval.generate_prompt(self.template, context, response, fact)
+        result["batch_context"] = context
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise Overloaded(f"Coda piena ({self.max_pending} valutazioni in attesa).")
+            self._pending += 1
+            self.stats["submitted"] += 1
+        future = Future()
+        future.add_done_callback(self._done)
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (result, future, time.perf_counter()))
+        return future
+
+    def score(self, context, response, fact=None, timeout=None):
+        """Versione bloccante di `submit`: restituisce il risultato della valutazione."""
+        return self.submit(context, response, fact).result(timeout)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self.stats["failed" if future.exception() else "completed"] += 1
+
+    async def _serve(self, ready):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        if self.g_eval.requests_per_minute:
+            self._bucket = TokenBucket(self.g_eval.requests_per_minute)
+        ready.set()
+
+        tasks = set()
+        stopping = False
+        while not stopping:
+            entry = await self._queue.get()
+            if entry is None:
+                break
+            batch = [entry]
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    if self._queue.empty():
+                        entry = await asyncio.wait_for(self._queue.get(), deadline - self._loop.time())
+                    else:
+                        entry = self._queue.get_nowait()
+                except asyncio.TimeoutError:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            task = asyncio.create_task(self._score_batch(batch))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def _send(self, prompt, options):
+        """Invia una richiesta; una richiesta identica ancora in corso (anche di un altro batch) viene riusata."""
+        key = prompt_key([prompt, options])
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(
+                self.g_eval.asend_request(prompt, bucket=self._bucket, **options))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["deduplicated"] += 1
+        return await asyncio.shield(task)
+
+    async def _score_batch(self, batch):
+        self.stats["batches"] += 1
+        self.stats["batched"] += len(batch)
+        if self.batch_template:
+            batch = await self._score_contexts(batch)
+        groups = {}
+        for entry in batch:
+            groups.setdefault(prompt_key(entry[0]["prompt"]), []).append(entry)
+        self.stats["deduplicated"] += len(batch) - len(groups)
+        await asyncio.gather(*(self._score_group(group) for group in groups.values()))
+
+    async def _score_contexts(self, batch):
+        """Valuta insieme le risposte con lo stesso contesto; restituisce quelle ancora da valutare singolarmente."""
+        contexts = {}
+        for entry in batch:
+            contexts.setdefault(entry[0]["batch_context"], []).append(entry)
+        remaining = [group[0] for group in contexts.values() if len(group) == 1]
+        metrics = self.g_eval.metrics
+
+        async def run(context, group):
+            prompt = self.g_eval.generate_prompt(self.batch_template, context,
+                                                 format_batch_responses([result["response"] for result, _, _ in group]))
+            try:
+                evaluations = await self._send(prompt, dict(max_tokens=max(50, 15 * len(group))))
+            except Exception:
+                remaining.extend(group)
+                return
+            self.stats["batch_requests"] += 1
+            scores = parse_batch_scores(evaluations, len(group))
+            for slot, entry in enumerate(group, 1):
+                metrics.record_parse(scores.get(slot) is not None)
+                if scores.get(slot) is None:
+                    # Le risposte mancanti nella risposta batch vengono valutate singolarmente
+                    remaining.append(entry)
+                else:
+                    entry[0]["evaluation"]["Overall"] = scores[slot]
+                    self._resolve(entry)
+
+        await asyncio.gather(*(run(context, group) for context, group in contexts.items() if len(group) > 1))
+        return remaining
+
+    async def _score_group(self, group):
+        """Valuta un prompt (condiviso dai risultati di `group`), con fallback a campioni e nuove richieste."""
+        metrics = self.g_eval.metrics
+        prompt = format_prompt(group[0][0]["prompt"], self.dimensions, self.output_format)
+        try:
+            evaluations = await self._send(prompt, dict(self.options, fallback=self.sample_options)
+                                           if self.scoring == "logprobs" else self.options)
+            scores, variances = score_evaluations(evaluations, self.dimensions, self.scoring)
+            if scores is None:
+                # Logprob non disponibili: punteggio medio di più campioni
+                evaluations = await self._send(prompt, self.sample_options)
+                scores, variances = score_evaluations(evaluations, self.dimensions, "samples")
+            metrics.record_parse(all(value is not None for value in scores.values()))
+            for _ in range(self.max_reasks):
+                absent = [dimension for dimension, value in scores.items() if value is None]
+                if not absent:
+                    break
+                evaluations = await self._send(reask_prompt(prompt, answer_text(evaluations),
+                                                            reask_instruction(absent, self.output_format)),
+                                               self.reask_options)
+                scores.update({dimension: value for dimension, value in parse_scores(evaluations, absent).items()
+                               if value is not None})
+                metrics.record_reask(all(value is not None for value in scores.values()))
+        except Exception as e:
+            for _, future, _ in group:
+                future.set_exception(e)
+            return
+        if any(value is None for value in scores.values()):
+            metrics.record_unparsed(len(group))
+        for entry in group:
+            entry[0]["evaluation"].update(scores)
+            if variances is not None:
+                entry[0]["score_variance"] = dict(variances)
+            self._resolve(entry)
+
+    def _resolve(self, entry):
+        result, future, submitted = entry
+        self.latencies.append(time.perf_counter() - submitted)
+        result.pop("batch_context", None)
+        future.set_result(result)
+
+    def summary(self):
+        """Contatori del servizio, coda, dimensione media dei micro-batch, latenze e metriche del client."""
+        latencies = list(self.latencies)
+        with self._lock:
+            stats = dict(self.stats, pending=self._pending)
+        stats["mean_batch_size"] = stats["batched"] / stats["batches"] if stats["batches"] else 0.0
+        for p in (50, 90, 99):
+            stats[f"latency_p{p}"] = percentile(latencies, p)
+        stats["client"] = self.g_eval.metrics.summary()
+        return stats
+
+    def prometheus(self):
+        stats = self.summary()
+        lines = []
+        for name in ("submitted", "completed", "failed", "rejected", "batches", "batched", "batch_requests",
+                     "deduplicated"):
+            lines += [f"# TYPE geval_service_{name}_total counter", f"geval_service_{name}_total {stats[name]}"]
+        lines += ["# TYPE geval_service_pending gauge", f"geval_service_pending {stats['pending']}",
+                  "# TYPE geval_service_latency_seconds summary"]
+        for p in (50, 90, 99):
+            if stats[f"latency_p{p}"] is not None:
+                lines.append(f'geval_service_latency_seconds{{quantile="0.{p}"}} {stats[f"latency_p{p}"]:.6f}')
+        return "\n".join(lines) + "\n" + self.g_eval.metrics.prometheus()
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """
+    API HTTP del servizio:
+    - POST /score con {"context": ..., "response": ..., "fact": ...} restituisce il risultato della valutazione;
+    - GET /health restituisce lo stato e le valutazioni in attesa;
+    - GET /metrics restituisce le metriche in formato Prometheus (JSON con ?format=json).
+    """
+
+    service = None
+    timeout_seconds = 300
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, content_type="application/json", headers=None):
+        data = payload.encode("utf-8") if isinstance(payload, str) else json.dumps(payload,
+                                                                                   ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/health":
+            self._send(200, {"status": "ok", "pending": self.service.summary()["pending"]})
+        elif path == "/metrics" and "format=json" in query:
+            self._send(200, self.service.summary())
+        elif path == "/metrics":
+            self._send(200, self.service.prometheus(), "text/plain; version=0.0.4")
+        else:
+            self._send(404, {"error": f"Percorso non supportato: {path}"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            self._send(400, {"error": f"Content-Length non valido: {self.headers.get('Content-Length')}"})
+            self.close_connection = True
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._send(400, {"error": f"JSON non valido: {e}"})
+            return
+        if not isinstance(body, dict):
+            self._send(400, {"error": "Il corpo della richiesta deve essere un oggetto JSON."})
+            return
+        if self.path.rstrip("/") != "/score":
+            self._send(404, {"error": f"Percorso non supportato: {self.path}"})
+            return
+        try:
+            future = self.service.submit(body.get("context"), body.get("response"), body.get("fact"))
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+            return
+        except Overloaded as e:
+            self._send(503, {"error": str(e)}, headers={"Retry-After": "1"})
+            return
+        try:
+            result = future.result(self.timeout_seconds)
+        except Exception as e:
+            self._send(502, {"error": f"{e.__class__.__name__}: {e}"})
+            return
+        self._send(200, {key: value for key, value in result.items() if key != "prompt"})
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Coda di accept ampia: i client aprono molte connessioni contemporanee
+    request_queue_size = 256
+
+
+def _make_server(service, host, port):
+    handler = type("ConfiguredScoringHandler", (ScoringHandler,), {"service": service.start()})
+    return ScoringServer((host, port), handler)
+
+
+def start_server(service, host="127.0.0.1", port=8080):
+    """
+    Avvia il servizio e il server HTTP in un thread in background.
+
+    Returns:
+        tuple: (server, url) — chiamare `server.shutdown()` e poi `service.stop()` per fermarli.
+    """
+    server = _make_server(service, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def serve(service, host="127.0.0.1", port=8080):
+    """Esegue il server HTTP in primo piano fino a Ctrl+C."""
+    server = _make_server(service, host, port)
+    # SIGTERM (es. arresto del container) chiude il servizio come Ctrl+C, completando le valutazioni accodate
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"Servizio di valutazione in ascolto su http://{host}:{server.server_address[1]} (POST /score)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
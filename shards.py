@@ -0,0 +1,87 @@
+import glob
+import multiprocessing
+import re
+import traceback
+from evaluators.common import result_key
+from results_io import read_results, read_templates, split_extension, write_results
+
+_SHARD_SUFFIX = re.compile(r"\.shard-(\d+)-of-(\d+)\.(json|jsonl\.gz|parquet)$")
+
+
+def shard_output_path(output_file, shard_index, num_shards):
+    """Percorso dei risultati di uno shard, es. results/dstc.json -> results/dstc.shard-01-of-04.json."""
+    root, extension = split_extension(output_file)
+    width = max(2, len(str(num_shards - 1)))
+    return f"{root}.shard-{shard_index:0{width}d}-of-{num_shards:0{width}d}{extension or '.json'}"
+
+
+def shard_paths(pattern):
+    """
+    Espande il pattern glob dei file di shard (es. "results/dstc.shard-*.json") e segnala gli shard
+    mancanti rispetto al numero totale indicato nel nome dei file.
+    """
+    paths = sorted(path for path in glob.glob(pattern) if not path.endswith(".jsonl"))
+    if not paths:
+        raise ValueError(f"Nessun file di risultati trovato per {pattern}")
+    found = {}
+    for path in paths:
+        match = _SHARD_SUFFIX.search(path)
+        if match:
+            found.setdefault(int(match.group(2)), set()).add(int(match.group(1)))
+    for num_shards, indices in found.items():
+        missing = sorted(set(range(num_shards)) - indices)
+        if missing:
+            print(f"Attenzione: mancano gli shard {missing} di {num_shards}")
+    return paths
+
+
+def merge_shards(paths, output_file):
+    """
+    Unisce i risultati di più shard in un unico file (formato in base all'estensione), scartando i duplicati
+    (stessa `result_key`, es. shard rieseguiti o sovrapposti). I record con lo stesso testo ma indici diversi
+    restano distinti, come in un'esecuzione senza shard. Se tutti i risultati hanno `dialog_id` vengono
+    ordinati come nel dataset, altrimenti l'ordine è quello dei file e, al loro interno, dei risultati.
+    I prompt vengono conservati se presenti negli shard.
+
+    Returns:
+        list[dict]: I risultati uniti.
+    """
+    merged, seen, templates = [], set(), {}
+    for path in paths:
+        templates.update(read_templates(path))
+        for result in read_results(path, keep_prompts=True):
+            key = result_key(result)
+            if key not in seen:
+                seen.add(key)
+                merged.append(result)
+    if all(result.get("dialog_id") is not None for result in merged):
+        # Ordinamento stabile: i risultati dello stesso record (es. risposte USR) restano nel loro ordine
+        merged.sort(key=lambda result: result["dialog_id"])
+    write_results(merged, output_file, keep_prompts=True, templates=templates)
+    print(f"Uniti {len(merged)} risultati da {len(paths)} file in {output_file}")
+    return merged
+
+
+def _run_shard(run, kwargs):
+    """
+    Esegue uno shard nel processo worker. Le eccezioni dell'API OpenAI non possono essere ricostruite nel
+    processo principale (il pool resterebbe bloccato): vengono convertite in RuntimeError con il traceback.
+    """
+    try:
+        return run(**kwargs)
+    except Exception:
+        raise RuntimeError(f"shard {kwargs['shard_index']}: {traceback.format_exc()}") from None
+
+
+def launch_shards(run, kwargs, num_shards, processes=None):
+    """
+    Esegue `run(**kwargs, shard_index=i, num_shards=num_shards)` per ogni shard in processi separati
+    sulla macchina locale e restituisce i percorsi dei file di output degli shard.
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes or num_shards) as pool:
+        jobs = [pool.apply_async(_run_shard, (run, dict(kwargs, shard_index=i, num_shards=num_shards)))
+                for i in range(num_shards)]
+        for job in jobs:
+            job.get()
+    return [shard_output_path(kwargs["output_file"], i, num_shards) for i in range(num_shards)]
@@ -0,0 +1,42 @@
+import pytest
+from evaluators.common import parse_batch_scores, parse_scores
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Overall Quality: 2", 2),
+    ("**Overall Quality:** 3.", 3),
+    ("- Overall = 2/3", 2),
+    ("Overall: 2.5", 2.5),
+    ('{"Overall": 1}', 1),
+    ('{"Overall": "3"}', 3),
+    ("2", 2),
+    # Riga dei criteri del template con l'intervallo prima del separatore
+    ("Overall Quality (1-3): 2", 2),
+    ("Overall Quality (1 - 3): 3", 3),
+    ("Overall Quality - 2", 2),
+    ("The Overall Quality: 2", 2),
+    ("the overall quality - 1", 1),
+    # Vale l'ultima occorrenza
+    ("Overall Quality: 1\nCorrection:\nOverall Quality: 3", 3),
+])
+def test_parse_overall(text, expected):
+    assert parse_scores([text], ["Overall"]) == {"Overall": expected}
+
+
+@pytest.mark.parametrize("text", [
+    "The response is coherent and engaging.",
+    "Overall Quality (1-3): Is the overall quality of the response satisfactory?",
+])
+def test_parse_overall_missing(text):
+    assert parse_scores([text], ["Overall"]) == {"Overall": None}
+
+
+def test_parse_multiple_dimensions():
+    text = "Engaging (1-3): 2\nThe Uses Knowledge - 1\nOverall Quality: 3"
+    assert parse_scores([text], ["Engaging", "Uses Knowledge", "Overall"]) == \
+           {"Engaging": 2, "Uses Knowledge": 1, "Overall": 3}
+
+
+def test_parse_batch_scores():
+    text = "Response 1 - Overall Quality: 2\nResponse 2 - Overall Quality (1-3): 3\nResponse 3 - Overall - 1"
+    assert parse_batch_scores([text], 3) == {1: 2, 2: 3, 3: 1}
@@ -0,0 +1,19 @@
+import os
+from main import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_dry_run_needs_no_key_and_no_cache(monkeypatch, tmp_path, capsys):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.delenv("OPENAI_API_KEYS", raising=False)
+    monkeypatch.delenv("OPENAI_ENDPOINTS_FILE", raising=False)
+    cache_path = tmp_path / "cache" / "cache.sqlite"
+
+    main("dstc", os.path.join(ROOT, "datasets/dstc9_data.json"), None,
+         os.path.join(ROOT, "prompts/dstc_full_dialogue.txt"), str(tmp_path / "dstc.json"), 5,
+         cache_path=str(cache_path), dry_run=True)
+
+    assert "Richieste API: 5" in capsys.readouterr().out
+    assert not os.path.exists(cache_path.parent)
+    assert not os.path.exists(tmp_path / "dstc.json")
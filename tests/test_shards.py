@@ -0,0 +1,46 @@
+import os
+import pytest
+from benchmarks.stub_server import StubConfig, start_stub_server
+from cache import ResponseCache
+from g_eval import GEvalAPI
+from loaders import load_dataset
+from main import run_evaluation
+from shards import merge_shards, shard_output_path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NUM_SHARDS = 3
+
+
+@pytest.fixture(scope="module")
+def stub_url():
+    server, url = start_stub_server(StubConfig(latency=0, jitter=0, seed=0))
+    yield url
+    server.shutdown()
+
+
+def evaluate(stub_url, cache, output_file, shard_index=None):
+    # Cache condivisa: gli shard ricevono gli stessi punteggi dell'esecuzione senza shard
+    g_eval = GEvalAPI(api_key="stub", model="stub", max_concurrency=16, cache=cache, base_url=stub_url)
+    try:
+        data = load_dataset("convai", os.path.join(ROOT, "datasets/convai2_data.json"),
+                            shard_index=shard_index, num_shards=NUM_SHARDS)
+        return run_evaluation("convai", data, g_eval, None, os.path.join(ROOT, "prompts/convai_full_dialogue.txt"),
+                              output_file)
+    finally:
+        g_eval.close()
+
+
+def test_merged_shards_match_unsharded_run(stub_url, tmp_path):
+    # ConvAI2 contiene dialoghi con lo stesso testo e indici diversi: devono restare tutti
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    output_file = str(tmp_path / "convai.json")
+    unsharded = evaluate(stub_url, cache, output_file)
+    for shard_index in range(NUM_SHARDS):
+        evaluate(stub_url, cache, shard_output_path(output_file, shard_index, NUM_SHARDS), shard_index)
+
+    merged = merge_shards([shard_output_path(output_file, i, NUM_SHARDS) for i in range(NUM_SHARDS)],
+                          str(tmp_path / "merged.json"))
+
+    assert len({result["context"] for result in unsharded}) < len(unsharded)
+    assert [{k: v for k, v in result.items() if k != "prompt"} for result in merged] == \
+           [{k: v for k, v in result.items() if k != "prompt"} for result in unsharded]